@@ -4,7 +4,7 @@ source .venv/bin/activate
 export ZK_TOOLS_SECRET="$(openssl rand -hex 32)"
 export TZ='Atlantic/Canary'
 
-gunicorn -w 4 -b 0.0.0.0:8000 app:app   
+gunicorn -k gevent -w 1 --worker-connections 100 -b 0.0.0.0:8000 wsgi:app   
 
 
 
@@ -4,64 +4,100 @@ import argparse
 import sys
 
 from zk import const
-from zk_tools import connect_with_retries, _has_valid_card
+from zk_tools import connect_with_retries, get_users_cached, _has_valid_card
 from update_empl import update_employee_card
 
 DEFAULT_PORT = 4370
 
 
-def sync_cards(src_conn, dst_conn):
+def sync_cards(src_conn, dst_conn, src_users=None):
     """Sync card numbers from src_conn users to dst_conn matching by user_id.
 
     Only the ``card`` field is updated in the destination terminal; all the
     remaining user information is preserved as stored on ``dst_conn``.
+    ``src_users`` lets several destinations reuse a single read of the source.
     """
 
-    src_users = src_conn.get_users()
+    if src_users is None:
+        src_users = src_conn.get_users()
+    _, dst_by_user_id = get_users_cached(dst_conn)
 
     updated = 0
-    for src_u in src_users:
-        if not _has_valid_card(src_u):
-            continue
-
-        user_id = getattr(src_u, 'user_id', '')
-        if not user_id:
-            continue
-
-        if (update_employee_card(dst_conn, user_id=user_id, card=getattr(src_u, 'card', ''))):
-            updated += 1
+    disabled = False
+    try:
+        for src_u in src_users:
+            if not _has_valid_card(src_u):
+                continue
+
+            user_id = getattr(src_u, 'user_id', '')
+            if not user_id:
+                continue
+
+            card = getattr(src_u, 'card', '')
+            dst_u = dst_by_user_id.get(str(user_id))
+            if dst_u is None or str(card) == str(getattr(dst_u, 'card', '')):
+                # Nada que escribir: el usuario no existe en destino o ya tiene la tarjeta.
+                continue
+
+            if not disabled:
+                # El terminal deja de atender fichajes mientras se escriben las tarjetas.
+                dst_conn.disable_device()
+                disabled = True
+            if update_employee_card(dst_conn, user_id=user_id, card=card,
+                                    users_by_id=dst_by_user_id):
+                updated += 1
+    finally:
+        if disabled:
+            dst_conn.enable_device()
 
     return updated
 
 
 def main():
     parser = argparse.ArgumentParser(
-        description='Sync card numbers between two ZKTeco terminals'
+        description='Sync card numbers from one ZKTeco terminal to one or more terminals'
     )
     parser.add_argument('src_host', help='IP del terminal origen')
-    parser.add_argument('dst_host', help='IP del terminal destino')
+    parser.add_argument('dst_hosts', nargs='+', metavar='dst_host',
+                        help='IP del terminal destino (se admiten varios)')
     parser.add_argument('--port', type=int, default=DEFAULT_PORT,
-                        help='Puerto (mismo para ambos, default {0})'.format(DEFAULT_PORT))
+                        help='Puerto (mismo para todos, default {0})'.format(DEFAULT_PORT))
     args = parser.parse_args()
 
-    src_zk = dst_zk = src_conn = dst_conn = None
+    src_conn = None
+    failed = False
     try:
-        src_zk, src_conn = connect_with_retries(args.src_host, args.port)
-        dst_zk, dst_conn = connect_with_retries(args.dst_host, args.port)
-        print('Conectado a ambos terminales.')
+        _, src_conn = connect_with_retries(args.src_host, args.port)
+        src_users = src_conn.get_users()
+        print('Conectado al terminal origen.')
 
-        count = sync_cards(src_conn, dst_conn)
-        print('Actualizados {0} usuarios con tarjeta.'.format(count))
+        for dst_host in args.dst_hosts:
+            dst_conn = None
+            try:
+                _, dst_conn = connect_with_retries(dst_host, args.port)
+                count = sync_cards(src_conn, dst_conn, src_users=src_users)
+                print('{0}: actualizados {1} usuarios con tarjeta.'.format(dst_host, count))
+            except Exception as e:
+                print('Error en {0}: {1}'.format(dst_host, e))
+                failed = True
+            finally:
+                try:
+                    if dst_conn:
+                        dst_conn.disconnect()
+                except Exception:
+                    pass
     except Exception as e:
         print('Error: {0}'.format(e))
         sys.exit(1)
     finally:
-        for conn in (src_conn, dst_conn):
-            try:
-                if conn:
-                    conn.disconnect()
-            except Exception:
-                pass
+        try:
+            if src_conn:
+                src_conn.disconnect()
+        except Exception:
+            pass
+
+    if failed:
+        sys.exit(1)
 
 
 if __name__ == '__main__':
@@ -5,17 +5,26 @@ Para cada terminal registra la hora antes y después de la actualización en
 `terminal_time_updates.log`.
 """
 import argparse
+import asyncio
 import logging
+import re
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from itertools import chain
 from pathlib import Path
-from typing import Iterable, List, Tuple
+from typing import Iterable, Iterator, List, Tuple
 
 from zk_tools import DEFAULT_PORT, connect_with_retries
 
 TERMINAL_LIST = Path(__file__).resolve().parent / "terminales.txt"
 LOG_FILE = Path(__file__).resolve().parent / "terminal_time_updates.log"
 DRIFT_THRESHOLD_SECONDS = 60
+DEFAULT_CONCURRENCY = 16
+
+# Líneas vacías o comentarios, y "nombre, ip" con espacios opcionales.
+_SKIP_LINE_RE = re.compile(r"\s*(?:#|$)")
+_TERMINAL_LINE_RE = re.compile(r"\s*([^,]*?)\s*,\s*(.*?)\s*$")
 
 
 def setup_logging() -> None:
@@ -30,27 +39,27 @@ def setup_logging() -> None:
     )
 
 
-def parse_terminal_list(path: Path) -> List[Tuple[str, str]]:
-    terminals: List[Tuple[str, str]] = []
+def parse_terminal_list(path: Path) -> Iterator[Tuple[str, str]]:
+    """Devuelve un iterador perezoso de (nombre, ip) leídos del fichero de terminales."""
     if not path.exists():
         raise FileNotFoundError(f"No se encontró el fichero de terminales: {path}")
+    return _iter_terminal_list(path)
+
 
+def _iter_terminal_list(path: Path) -> Iterator[Tuple[str, str]]:
     with path.open(encoding="utf-8") as fh:
         for line_no, raw in enumerate(fh, start=1):
-            line = raw.strip()
-            if not line or line.startswith("#"):
+            if _SKIP_LINE_RE.match(raw):
                 continue
-            if "," not in line:
-                logging.warning("Línea %s sin separador ',': %s", line_no, line)
+            match = _TERMINAL_LINE_RE.match(raw)
+            if match is None:
+                logging.warning("Línea %s sin separador ',': %s", line_no, raw.strip())
                 continue
-            name_part, ip_part = line.split(",", 1)
-            ip = ip_part.strip()
+            name, ip = match.groups()
             if not ip:
-                logging.warning("Línea %s sin IP válida: %s", line_no, line)
+                logging.warning("Línea %s sin IP válida: %s", line_no, raw.strip())
                 continue
-            name = name_part.strip() or ip
-            terminals.append((name, ip))
-    return terminals
+            yield name or ip, ip
 
 
 def _log_with_drift(message: str, drift_seconds: float, base_level: int = logging.INFO) -> None:
@@ -97,9 +106,20 @@ def sync_terminal_time(name: str, host: str, port: int, only_read: bool = False)
             pass
 
 
-def sync_all(terminals: Iterable[Tuple[str, str]], port: int, only_read: bool) -> None:
-    for name, host in terminals:
-        sync_terminal_time(name, host, port, only_read=only_read)
+async def sync_all(
+    terminals: Iterable[Tuple[str, str]],
+    port: int,
+    only_read: bool,
+    concurrency: int = DEFAULT_CONCURRENCY,
+) -> None:
+    """Sincroniza los terminales en paralelo; pyzk es bloqueante, así que usa hilos."""
+    loop = asyncio.get_running_loop()
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        tasks = [
+            loop.run_in_executor(executor, sync_terminal_time, name, host, port, only_read)
+            for name, host in terminals
+        ]
+        await asyncio.gather(*tasks)
 
 
 def main() -> None:
@@ -123,16 +143,25 @@ def main() -> None:
         action="store_true",
         help="Solo consulta la fecha y hora de cada terminal sin actualizarla",
     )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=DEFAULT_CONCURRENCY,
+        help=f"Terminales procesados en paralelo (por defecto {DEFAULT_CONCURRENCY})",
+    )
     args = parser.parse_args()
 
     setup_logging()
     logging.info("Leyendo terminales de %s", args.file)
     terminals = parse_terminal_list(args.file)
-    if not terminals:
+    first = next(terminals, None)
+    if first is None:
         logging.warning("No se encontraron terminales en %s", args.file)
         return
 
-    sync_all(terminals, args.port, args.only_read)
+    asyncio.run(
+        sync_all(chain((first,), terminals), args.port, args.only_read, args.concurrency)
+    )
     if args.only_read:
         logging.info("Consulta completada. Log en %s", LOG_FILE)
     else:
@@ -2,35 +2,64 @@
 from __future__ import print_function
 import argparse
 import sys
+from operator import attrgetter
 
 from zk import const
-from zk_tools import connect_with_retries
+from zk_tools import connect_with_retries, get_users_cached, invalidate_users_cache
 
 DEFAULT_PORT = 4370
 TARGET_USER_ID = '1800409'
 NEW_CARD = '1977255'
 
+_get_user_fields = attrgetter('uid', 'name', 'privilege', 'password', 'group_id', 'user_id')
 
-def update_employee_card(conn, user_id=TARGET_USER_ID, card=NEW_CARD):
-    """Busca al usuario por user_id y actualiza su tarjeta."""
-    users = conn.get_users()
-    for u in users:
-        if str(getattr(u, 'user_id', '')) == str(user_id):
-            if str(getattr(u, 'card', '')) != str(card):
-                conn.set_user(
-                    uid=u.uid,
-                    name=getattr(u, 'name', ''),
-                    privilege=getattr(u, 'privilege', const.USER_DEFAULT),
-                    password=getattr(u, 'password', ''),
-                    group_id=getattr(u, 'group_id', ''),
-                    user_id=getattr(u, 'user_id', ''),
-                    card=card,
-                )
-                print(f'Usuario: {user_id}, tarjeta actualizada')
-                return True
-            else:
-                print(f'Usuario: {user_id}, tarjeta ya es igual. No se actualiza')
-                return False
+
+def _user_fields(u):
+    """Devuelve (uid, name, privilege, password, group_id, user_id) del usuario.
+
+    Los usuarios de pyzk tienen siempre estos atributos; el camino con valores
+    por defecto solo se usa con objetos incompletos.
+    """
+    try:
+        return _get_user_fields(u)
+    except AttributeError:
+        return (
+            u.uid,
+            getattr(u, 'name', ''),
+            getattr(u, 'privilege', const.USER_DEFAULT),
+            getattr(u, 'password', ''),
+            getattr(u, 'group_id', ''),
+            getattr(u, 'user_id', ''),
+        )
+
+
+def update_employee_card(conn, user_id=TARGET_USER_ID, card=NEW_CARD, users_by_id=None):
+    """Busca al usuario por user_id y actualiza su tarjeta.
+
+    `users_by_id` permite reutilizar un índice user_id -> usuario ya construido
+    (p.ej. al sincronizar muchas tarjetas); si no se indica se usa la lectura
+    cacheada de `get_users_cached`.
+    """
+    if users_by_id is None:
+        _, users_by_id = get_users_cached(conn)
+    u = users_by_id.get(str(user_id))
+    if u is None:
+        return False
+    if str(getattr(u, 'card', '')) != str(card):
+        uid, name, privilege, password, group_id, dst_user_id = _user_fields(u)
+        conn.set_user(
+            uid=uid,
+            name=name,
+            privilege=privilege,
+            password=password,
+            group_id=group_id,
+            user_id=dst_user_id,
+            card=card,
+        )
+        invalidate_users_cache(conn)
+        print(f'Usuario: {user_id}, tarjeta actualizada')
+        return True
+    print(f'Usuario: {user_id}, tarjeta ya es igual. No se actualiza')
     return False
 
 
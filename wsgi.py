@@ -0,0 +1,17 @@
+"""Punto de entrada WSGI para servidores de producción (gunicorn, waitress...).
+
+La aplicación pasa la mayor parte del tiempo esperando a los terminales, por lo
+que se recomienda un único proceso con workers gevent:
+
+    gunicorn -k gevent -w 1 --worker-connections 100 -b 0.0.0.0:8000 wsgi:app
+
+Con un único proceso las cachés en memoria (empleados leídos, selección) son
+compartidas por todas las peticiones.
+"""
+from __future__ import annotations
+
+from zk_tools_web import app
+
+application = app
+
+__all__ = ["app", "application"]
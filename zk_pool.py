@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""Pool de conexiones reutilizables con terminales ZKTeco.
+
+Cada terminal (host, puerto) dispone de una pila de conexiones libres. Al
+reservar una conexión se comprueba que siga viva con ``get_time()`` y, si no
+queda ninguna válida, se abre una nueva con ``connect_with_retries``.
+
+Las conexiones libres mantienen abierta su sesión con el terminal, y los
+terminales admiten pocas sesiones simultáneas. Un hilo en segundo plano
+cierra las que llevan más de ``IDLE_TTL`` sin usarse, para que no bloqueen
+otras herramientas (sync_cards.py, sync_terminal_time.py, ZKTime).
+
+``submit`` ejecuta trabajos sobre una conexión del pool en hilos propios, de
+modo que quien lo llama puede esperar el resultado con un tiempo máximo. Al
+terminar el proceso se cierran las conexiones libres.
+"""
+from __future__ import annotations
+
+import atexit
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple, Union
+
+from zk_tools import DEFAULT_PORT, connect_with_retries
+
+logger = logging.getLogger(__name__)
+
+MAX_SIZE = 4  # conexiones libres por terminal
+IDLE_TTL = 60.0  # segundos que una conexión libre se considera reutilizable
+FAIL_FAST_TIMEOUT = 5  # segundos para conexiones opcionales (un solo intento)
+JOB_WORKERS = 8  # hilos que ejecutan trabajos enviados con submit()
+
+_POOLS: Dict[Tuple[str, int], queue.LifoQueue] = {}
+_LOCK = threading.Lock()
+_EXECUTOR = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="zk-job")
+_SWEEPER: Optional[threading.Thread] = None
+
+
+def _get_pool(host: str, port: int) -> queue.LifoQueue:
+    key = (host, port)
+    with _LOCK:
+        pool = _POOLS.get(key)
+        if pool is None:
+            pool = _POOLS[key] = queue.LifoQueue(maxsize=MAX_SIZE)
+            _start_sweeper()
+        return pool
+
+
+def _start_sweeper() -> None:
+    """Arranca el hilo que cierra conexiones ociosas (llamar con ``_LOCK``)."""
+    global _SWEEPER
+    if _SWEEPER is not None and _SWEEPER.is_alive():
+        return
+    _SWEEPER = threading.Thread(target=_sweep_loop, name="zk-pool-sweeper", daemon=True)
+    _SWEEPER.start()
+
+
+def _sweep_loop() -> None:
+    while True:
+        time.sleep(IDLE_TTL / 2)
+        try:
+            close_idle()
+        except Exception:  # pragma: no cover - no debe detener el barrido
+            logger.exception("Error al cerrar conexiones ociosas")
+
+
+def close_idle() -> None:
+    """Cierra las conexiones libres que llevan más de IDLE_TTL sin usarse."""
+    with _LOCK:
+        pools = list(_POOLS.items())
+    now = time.monotonic()
+    for (host, _), pool in pools:
+        kept = []
+        while True:
+            try:
+                released_at, conn = pool.get_nowait()
+            except queue.Empty:
+                break
+            if now - released_at > IDLE_TTL:
+                _close(conn, host)
+            else:
+                kept.append((released_at, conn))
+        # Se devuelven de la más antigua a la más reciente para conservar el orden LIFO.
+        for entry in reversed(kept):
+            try:
+                pool.put_nowait(entry)
+            except queue.Full:
+                _close(entry[1], host)
+
+
+def _close(conn, host: str) -> None:
+    try:
+        conn.disconnect()
+    except Exception:  # pragma: no cover - errores de red
+        logger.debug("Error al desconectar del terminal %s", host, exc_info=True)
+
+
+def acquire(host: str, port: int = DEFAULT_PORT, fail_fast: bool = False):
+    """Devuelve una conexión libre y válida con el terminal, o abre una nueva.
+
+    Con ``fail_fast`` la conexión nueva se intenta una sola vez con un tiempo
+    máximo corto, para conexiones opcionales que tienen alternativa.
+    """
+    pool = _get_pool(host, port)
+    while True:
+        try:
+            released_at, conn = pool.get_nowait()
+        except queue.Empty:
+            break
+        if time.monotonic() - released_at > IDLE_TTL:
+            _close(conn, host)
+            continue
+        try:
+            conn.get_time()
+        except Exception:
+            _close(conn, host)
+            continue
+        return conn
+
+    if fail_fast:
+        _, conn = connect_with_retries(host, port, timeout=FAIL_FAST_TIMEOUT, retries=1)
+    else:
+        _, conn = connect_with_retries(host, port)
+    return conn
+
+
+def release(host: str, port: int, conn, healthy: bool = True) -> None:
+    """Devuelve la conexión al pool o la cierra si no es reutilizable."""
+    if conn is None:
+        return
+    if not healthy:
+        _close(conn, host)
+        return
+    try:
+        _get_pool(host, port).put_nowait((time.monotonic(), conn))
+    except queue.Full:
+        _close(conn, host)
+
+
+@contextmanager
+def reserve(host: str, port: int = DEFAULT_PORT, fail_fast: bool = False) -> Iterator:
+    """Reserva una conexión durante el bloque ``with`` y la devuelve al terminar.
+
+    Si el bloque lanza una excepción la conexión se descarta en lugar de
+    reutilizarse, por si quedó en un estado inconsistente. ``fail_fast`` se
+    pasa a ``acquire``.
+    """
+    conn = acquire(host, port, fail_fast=fail_fast)
+    try:
+        yield conn
+    except BaseException:
+        release(host, port, conn, healthy=False)
+        raise
+    else:
+        release(host, port, conn)
+
+
+def _run_job(host: str, port: int, job: Union[str, Callable], args, kwargs) -> Any:
+    with reserve(host, port) as conn:
+        if isinstance(job, str):
+            return getattr(conn, job)(*args, **kwargs)
+        return job(conn, *args, **kwargs)
+
+
+def submit(host: str, port: int, job: Union[str, Callable], *args, **kwargs) -> Future:
+    """Ejecuta un trabajo con una conexión del pool fuera del hilo que lo solicita.
+
+    ``job`` puede ser el nombre de un método de la conexión (p.ej. ``"get_users"``)
+    o una función que recibe la conexión como primer argumento.
+    """
+    return _EXECUTOR.submit(_run_job, host, port, job, args, kwargs)
+
+
+def close_all() -> None:
+    """Cierra todas las conexiones libres de todos los terminales."""
+    with _LOCK:
+        pools = list(_POOLS.items())
+        _POOLS.clear()
+    for (host, _), pool in pools:
+        while True:
+            try:
+                _, conn = pool.get_nowait()
+            except queue.Empty:
+                break
+            _close(conn, host)
+
+
+atexit.register(close_all)
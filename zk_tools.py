@@ -4,26 +4,31 @@ import argparse
 import socket
 import sys
 import os, time
+import re
 import datetime
+import functools
+import weakref
+from concurrent.futures import ThreadPoolExecutor
 
 from zk import ZK, const  # pyzk / zk
 
 DEFAULT_PORT = 4370
 RETRIES = 3
 RETRY_DELAY = 2  # segundos
+VERIF_MODE_CONCURRENCY = 4  # conexiones simultáneas al leer el modo de verificación
 
 
-def connect_with_retries(host, port, timeout=10):
+def connect_with_retries(host, port, timeout=10, retries=RETRIES):
     last_exc = None
     attempt = 1
-    while attempt <= RETRIES:
+    while attempt <= retries:
         try:
             zk = ZK(host, port=port, timeout=timeout, verbose=False)
             conn = zk.connect()
             return zk, conn
         except (socket.timeout, OSError, Exception) as e:
             last_exc = e
-            if attempt < RETRIES:
+            if attempt < retries:
                 time.sleep(RETRY_DELAY)
                 attempt += 1
             else:
@@ -31,70 +36,156 @@ def connect_with_retries(host, port, timeout=10):
     return None, None
 
 
-def _u(obj):
-    """Devuelve una representación segura para impresión en py2/py3."""
-    try:
-        basestring  # noqa (solo existe en py2)
-        if isinstance(obj, unicode):  # noqa
+_USERS_CACHE = weakref.WeakKeyDictionary()
+USERS_CACHE_TTL = 30  # segundos
+
+
+def get_users_cached(conn, ttl=USERS_CACHE_TTL):
+    """Devuelve (usuarios, índice por user_id) reutilizando la última lectura de `conn`."""
+    now = time.monotonic()
+    entry = _USERS_CACHE.get(conn)
+    if entry is not None and now - entry[0] < ttl:
+        return entry[1], entry[2]
+    users = conn.get_users()
+    by_user_id = {}
+    for u in users:
+        by_user_id.setdefault(str(getattr(u, 'user_id', '')), u)
+    _USERS_CACHE[conn] = (now, users, by_user_id)
+    return users, by_user_id
+
+
+def invalidate_users_cache(conn):
+    """Descarta la lectura de usuarios guardada para `conn`."""
+    _USERS_CACHE.pop(conn, None)
+
+
+try:
+    _text_type = unicode  # noqa (solo existe en py2)
+except NameError:
+    _text_type = None
+
+if _text_type is None:
+    _u = str  # representación segura para impresión: en py3 basta con str()
+else:  # pragma: no cover - solo py2
+    def _u(obj):
+        """Devuelve una representación segura para impresión en py2."""
+        if isinstance(obj, _text_type):
             return obj.encode('utf-8')
         return str(obj)
-    except NameError:
-        return str(obj)
+
+
+_INVALID_CARDS = frozenset(("", "0", "none", "null"))
+_ZERO_CARD_RE = re.compile(r"[+-]?0+$")
 
 
 def _has_valid_card(user):
     """True si el usuario tiene tarjeta no vacía/0."""
-    if not hasattr(user, "card"):
-        return False
     val = getattr(user, "card", None)
-    if val is None:
+    if not val:
         return False
     s = str(val).strip()
-    if s.lower() in ("", "0", "none", "null"):
-        return False
-    try:
-        if int(s) == 0:
-            return False
-    except Exception:
-        pass
-    return True
+    return s.lower() not in _INVALID_CARDS and not _ZERO_CARD_RE.match(s)
 
 
-def list_functions(conn):
-    print('--- Funciones soportadas ---')
-    for name in dir(conn):
+@functools.lru_cache(maxsize=None)
+def _public_functions(cls):
+    """Devuelve (nombre, docstring) de los métodos públicos de la clase, una sola vez."""
+    entries = []
+    for name in dir(cls):
         if not name.startswith("_"):
-            func = getattr(conn, name)
+            func = getattr(cls, name, None)
             if callable(func):
                 doc = getattr(func, "__doc__", "")
-                print("=================================================================")
-                print("{0}:\n  {1}\n".format(name, doc.strip() if doc else "No docstring"))
+                entries.append((name, doc.strip() if doc else "No docstring"))
+    return tuple(entries)
+
 
+@functools.lru_cache(maxsize=None)
+def _functions_listing(cls):
+    """Texto completo de ``list_functions`` para la clase, formateado una vez."""
+    return "".join(
+        "=================================================================\n"
+        "{0}:\n  {1}\n\n".format(name, doc)
+        for name, doc in _public_functions(cls)
+    )
 
-def list_users(conn, solo_tarjeta=False):
+
+def list_functions(conn):
+    print('--- Funciones soportadas ---')
+    print(_functions_listing(type(conn)), end='')
+
+
+def _read_verif_mode(get_verif_mode, uid):
+    try:
+        verif_mode = get_verif_mode(uid)  # devuelve str o None (Group)
+        if verif_mode is None:
+            verif_mode = 'Group'  # modo por grupo
+    except Exception as e:
+        verif_mode = f'N/A ({e})'  # terminal no soporta, timeout, etc.
+    return verif_mode
+
+
+def _read_verif_modes(conn, uids, host=None, port=DEFAULT_PORT, concurrency=VERIF_MODE_CONCURRENCY):
+    """Lee el modo de verificación de cada UID.
+
+    Una conexión pyzk no admite peticiones simultáneas, así que si se conoce el
+    host se abren conexiones adicionales y los UID se reparten entre ellas. Si
+    el terminal no acepta más sesiones se sigue en serie con ``conn``.
+    """
+    extra = []
+    if host and concurrency > 1 and len(uids) > 1:
+        for _ in range(min(concurrency, len(uids)) - 1):
+            try:
+                extra.append(ZK(host, port=port, timeout=10, verbose=False).connect())
+            except Exception:
+                break
+    conns = [conn] + extra
+    try:
+        if len(conns) == 1:
+            get_verif_mode = conn.get_user_verif_mode
+            return [_read_verif_mode(get_verif_mode, uid) for uid in uids]
+
+        def read_slice(index):
+            get_verif_mode = conns[index].get_user_verif_mode
+            return [_read_verif_mode(get_verif_mode, uid) for uid in uids[index::len(conns)]]
+
+        with ThreadPoolExecutor(max_workers=len(conns)) as executor:
+            slices = list(executor.map(read_slice, range(len(conns))))
+        modes = [None] * len(uids)
+        for index, values in enumerate(slices):
+            modes[index::len(conns)] = values
+        return modes
+    finally:
+        for extra_conn in extra:
+            try:
+                extra_conn.disconnect()
+            except Exception:
+                pass
+
+
+def list_users(conn, solo_tarjeta=False, host=None, port=DEFAULT_PORT):
     print('--- Users ---')
     users = conn.get_users()
+    if solo_tarjeta:
+        users = [u for u in users if _has_valid_card(u)]
+    verif_modes = _read_verif_modes(conn, [u.uid for u in users], host=host, port=port)
+    user_admin = const.USER_ADMIN
+    write = sys.stdout.write
     total = 0
-    for u in users:
-        if solo_tarjeta and not _has_valid_card(u):
-            continue
-        print(u.__dict__)
-        privilege = 'Admin' if u.privilege == const.USER_ADMIN else 'User'
-        try:
-            verif_mode = conn.get_user_verif_mode(u.uid)  # devuelve str o None (Group)
-            if verif_mode is None:
-                verif_mode = 'Group'  # modo por grupo
-        except Exception as e:
-            verif_mode = f'N/A ({e})'  # terminal no soporta, timeout, etc.
-        print('+ UID #{0}'.format(_u(u.uid)))
-        print('  Name      : {0}'.format(_u(u.name)))
-        print('  Privilege : {0}'.format(privilege))
-        print(f'  VerifMode : {verif_mode}')
-        print('  Group ID  : {0}'.format(_u(u.group_id)))
-        print('  User ID   : {0}'.format(_u(u.user_id)))
-        if hasattr(u, "card"):
-            print('  Card      : {0}'.format(_u(u.card)))
-        print('')
+    for u, verif_mode in zip(users, verif_modes):
+        privilege = 'Admin' if u.privilege == user_admin else 'User'
+        card_line = f'  Card      : {_u(u.card)}\n' if hasattr(u, 'card') else ''
+        # Un único write por usuario en lugar de un print por línea.
+        write(
+            f'{u.__dict__}\n'
+            f'+ UID #{_u(u.uid)}\n'
+            f'  Name      : {_u(u.name)}\n'
+            f'  Privilege : {privilege}\n'
+            f'  VerifMode : {verif_mode}\n'
+            f'  Group ID  : {_u(u.group_id)}\n'
+            f'  User ID   : {_u(u.user_id)}\n'
+            f'{card_line}\n'
+        )
         total += 1
     print('Total usuarios{0}: {1}'.format(' con tarjeta' if solo_tarjeta else '', total))
 
@@ -175,7 +266,7 @@ def main():
             device_enable(conn, enable=False)
 
         if args.list_users:
-            list_users(conn, solo_tarjeta=args.solo_tarjeta)
+            list_users(conn, solo_tarjeta=args.solo_tarjeta, host=args.host, port=args.port)
 
         if args.voice_test:
             voice_test(conn)
@@ -2,6 +2,7 @@
 from __future__ import annotations
 
 from flask import Flask, g
+from jinja2 import FileSystemBytecodeCache
 
 from . import db
 import os
@@ -9,6 +10,8 @@ import os
 def create_app() -> Flask:
     """Crea y configura la aplicación Flask."""
     app = Flask(__name__, template_folder="templates", static_folder="static")
+    # Comparte las plantillas compiladas entre procesos (p.ej. workers de gunicorn).
+    app.jinja_options = {**app.jinja_options, "bytecode_cache": FileSystemBytecodeCache()}
 #    app.secret_key = "zk-tools-dev"
     app.secret_key = os.getenv("ZK_TOOLS_SECRET", "fapdavnajkds232ñfdañva")
 
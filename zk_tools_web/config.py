@@ -2,10 +2,16 @@
 from __future__ import annotations
 
 import os
+import re
 from pathlib import Path
+from types import MappingProxyType
 from typing import Dict
 
 
+# Una asignación CLAVE=valor por línea; se ignoran líneas vacías y comentarios.
+_ENV_LINE_RE = re.compile(r"^[^\S\n]*([^#\s=][^=\n]*?)[^\S\n]*=[^\S\n]*(.*?)[^\S\n]*$", re.MULTILINE)
+
+
 def _clean_value(value: str) -> str:
     """Normaliza un valor eliminando comillas envolventes."""
     if len(value) >= 2 and value[0] == value[-1] and value[0] in {"'", '"'}:
@@ -18,22 +24,20 @@ def _load_env_file(env_path: Path) -> Dict[str, str]:
     if not env_path.exists():
         return {}
 
-    data: Dict[str, str] = {}
-    for raw_line in env_path.read_text(encoding="utf-8").splitlines():
-        line = raw_line.strip()
-        if not line or line.startswith("#") or "=" not in line:
-            continue
-
-        key, value = line.split("=", 1)
-        data[key.strip()] = _clean_value(value.strip())
-
-    return data
+    text = env_path.read_text(encoding="utf-8")
+    return {key: _clean_value(value) for key, value in _ENV_LINE_RE.findall(text)}
 
 
 _ENV_CACHE = _load_env_file(Path(__file__).resolve().parents[1] / ".env")
 
+# Valores de las claves del .env resueltos una vez al importar (el entorno tiene prioridad).
+_SETTINGS = MappingProxyType({key: os.getenv(key, value) for key, value in _ENV_CACHE.items()})
+
 
 def get_setting(key: str, default: str | None = None) -> str | None:
     """Obtiene un valor de configuración, priorizando variables de entorno."""
-    return os.getenv(key, _ENV_CACHE.get(key, default))
+    value = _SETTINGS.get(key)
+    if value is not None:
+        return value
+    return os.getenv(key, default)
 
@@ -1,30 +1,123 @@
 """Utilities for SQLite persistence."""
 from __future__ import annotations
 
+import hashlib
+import hmac
+import queue
+import secrets
 import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Dict, Iterable, List, Optional
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
 
 from flask import current_app, g
 from werkzeug.security import check_password_hash, generate_password_hash
 
+try:  # gevent is optional: only present under the gevent gunicorn worker
+    import gevent
+    from gevent import monkey as gevent_monkey
+except ImportError:  # pragma: no cover - depends on the environment
+    gevent = gevent_monkey = None
+
 DB_PATH = Path(__file__).resolve().parent / "zk_tools.sqlite3"
+POOL_SIZE = 8
+# INSERT ... RETURNING is available from SQLite 3.35.
+_HAS_RETURNING = sqlite3.sqlite_version_info >= (3, 35)
+
+_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=67108864",
+    "PRAGMA cache_size=-8192",
+)
+
+# Journal mode is persistent in the file, so read-only connections skip it.
+_RO_PRAGMAS = _PRAGMAS[1:]
+
+_pool: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue(maxsize=POOL_SIZE)
+_ro_pool: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue(maxsize=POOL_SIZE)
+
+# Explicit KDF for new password hashes (OpenSSL-backed, memory-hard). Hashes
+# created with other methods keep verifying and are upgraded on next login.
+PASSWORD_HASH_METHOD = "scrypt"
+
+# Recent check_password_hash results. Keys include the stored hash (so a
+# password change invalidates them) and an HMAC of the password under a
+# per-process random key; the plain password is never kept.
+AUTH_CACHE_TTL = 60.0
+AUTH_FAILURE_TTL = 1.0
+AUTH_CACHE_SIZE = 256
+_AUTH_CACHE: Dict[tuple, tuple] = {}
+_AUTH_CACHE_LOCK = threading.Lock()
+_AUTH_CACHE_KEY = secrets.token_bytes(32)
+
+# Users loaded on every request by load_logged_in_user, cached per id in a
+# small LRU so ids that stop logging in are eventually evicted.
+USER_CACHE_TTL = 30.0
+USER_CACHE_SIZE = 256
+_USER_CACHE: "OrderedDict[int, tuple]" = OrderedDict()
+_USER_CACHE_LOCK = threading.Lock()
+
+
+def _open_connection(read_only: bool = False) -> sqlite3.Connection:
+    if read_only:
+        connection = sqlite3.connect(
+            f"{DB_PATH.as_uri()}?mode=ro", uri=True, check_same_thread=False
+        )
+    else:
+        connection = sqlite3.connect(DB_PATH, check_same_thread=False)
+    connection.row_factory = sqlite3.Row
+    for pragma in _RO_PRAGMAS if read_only else _PRAGMAS:
+        connection.execute(pragma)
+    return connection
+
+
+def _lease(attr: str, pool: "queue.LifoQueue[sqlite3.Connection]", read_only: bool) -> sqlite3.Connection:
+    connection = g.get(attr)
+    if connection is None:
+        try:
+            connection = pool.get_nowait()
+        except queue.Empty:
+            connection = _open_connection(read_only)
+        setattr(g, attr, connection)
+    return connection
 
 
 def get_connection() -> sqlite3.Connection:
-    """Return a SQLite connection stored in the application context."""
-    if "_db_conn" not in g:
-        g._db_conn = sqlite3.connect(DB_PATH)
-        g._db_conn.row_factory = sqlite3.Row
-    return g._db_conn  # type: ignore[return-value]
+    """Return a pooled read-write SQLite connection leased for the application context."""
+    return _lease("_db_conn", _pool, read_only=False)
 
 
-def close_connection(_: Optional[BaseException] = None) -> None:
-    connection: Optional[sqlite3.Connection] = g.pop("_db_conn", None)
-    if connection is not None:
+def get_ro_connection() -> sqlite3.Connection:
+    """Return a pooled read-only SQLite connection leased for the application context.
+
+    Reads through it never wait on the writer under WAL. Use it only for
+    queries that do not need to see the current request's uncommitted writes.
+    """
+    return _lease("_db_ro_conn", _ro_pool, read_only=True)
+
+
+def _release(connection: Optional[sqlite3.Connection], pool: "queue.LifoQueue[sqlite3.Connection]") -> None:
+    if connection is None:
+        return
+    try:
+        if connection.in_transaction:
+            connection.rollback()
+        pool.put_nowait(connection)
+    except (sqlite3.Error, queue.Full):
         connection.close()
 
 
+def close_connection(_: Optional[BaseException] = None) -> None:
+    """Return the leased connections to their pools, closing them if a pool is full."""
+    _release(g.pop("_db_conn", None), _pool)
+    _release(g.pop("_db_ro_conn", None), _ro_pool)
+
+
 def init_db() -> None:
     connection = get_connection()
     connection.executescript(
@@ -36,6 +129,8 @@ def init_db() -> None:
             is_admin INTEGER NOT NULL DEFAULT 0,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         );
+        CREATE INDEX IF NOT EXISTS idx_users_username_nocase
+            ON users (username COLLATE NOCASE);
         """
     )
     connection.commit()
@@ -51,93 +146,196 @@ def init_app(app) -> None:
         ensure_default_admin()
 
 
-def _row_to_user(row: sqlite3.Row) -> Dict[str, object]:
-    return {
-        "id": row["id"],
-        "username": row["username"],
-        "is_admin": bool(row["is_admin"]),
-        "created_at": row["created_at"],
-    }
+class UserRow(NamedTuple):
+    """A user as returned by the query helpers (never includes the password hash)."""
 
+    id: int
+    username: str
+    is_admin: bool
+    created_at: str
 
-def list_users() -> List[Dict[str, object]]:
-    connection = get_connection()
+    def __getitem__(self, key: Any) -> Any:
+        # Keep the former dict-style access (user["id"]) working.
+        if isinstance(key, str):
+            return getattr(self, key)
+        return tuple.__getitem__(self, key)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return getattr(self, key, default)
+
+
+_USER_COLUMNS = "id, username, is_admin, created_at"
+
+
+def _row_to_user(row: sqlite3.Row) -> UserRow:
+    return UserRow(row[0], row[1], bool(row[2]), row[3])
+
+
+def list_users() -> List[UserRow]:
+    connection = get_ro_connection()
     rows = connection.execute(
-        "SELECT id, username, is_admin, created_at FROM users ORDER BY username COLLATE NOCASE"
+        f"SELECT {_USER_COLUMNS} FROM users ORDER BY username COLLATE NOCASE"
     ).fetchall()
     return [_row_to_user(row) for row in rows]
 
 
-def get_user_by_id(user_id: int) -> Optional[Dict[str, object]]:
-    connection = get_connection()
+def get_user_by_id(user_id: int) -> Optional[UserRow]:
+    """Return the user with ``user_id``, served from a short-lived cache when possible."""
+    with _USER_CACHE_LOCK:
+        cached = _USER_CACHE.get(user_id)
+        if cached is not None and time.monotonic() - cached[0] < USER_CACHE_TTL:
+            _USER_CACHE.move_to_end(user_id)
+            return cached[1]
+    connection = get_ro_connection()
     row = connection.execute(
-        "SELECT id, username, is_admin, created_at FROM users WHERE id = ?",
+        f"SELECT {_USER_COLUMNS} FROM users WHERE id = ?",
         (user_id,),
     ).fetchone()
     if row is None:
+        _invalidate_user(user_id)
         return None
-    return _row_to_user(row)
+    user = _row_to_user(row)
+    with _USER_CACHE_LOCK:
+        _USER_CACHE[user_id] = (time.monotonic(), user)
+        _USER_CACHE.move_to_end(user_id)
+        while len(_USER_CACHE) > USER_CACHE_SIZE:
+            _USER_CACHE.popitem(last=False)
+    return user
 
 
-def get_user_by_username(username: str) -> Optional[Dict[str, object]]:
-    connection = get_connection()
+def _invalidate_user(user_id: int) -> None:
+    with _USER_CACHE_LOCK:
+        _USER_CACHE.pop(user_id, None)
+
+
+def _get_credentials(username: str) -> Optional[Tuple[UserRow, str]]:
+    connection = get_ro_connection()
     row = connection.execute(
-        "SELECT id, username, password_hash, is_admin, created_at FROM users WHERE username = ?",
+        f"SELECT {_USER_COLUMNS}, password_hash FROM users WHERE username = ?",
         (username,),
     ).fetchone()
     if row is None:
         return None
-    user = _row_to_user(row)
-    user["password_hash"] = row["password_hash"]
-    return user
+    return _row_to_user(row), row[4]
 
 
-def authenticate_user(username: str, password: str) -> Optional[Dict[str, object]]:
-    user = get_user_by_username(username)
-    if not user:
+def get_user_by_username(username: str) -> Optional[UserRow]:
+    credentials = _get_credentials(username)
+    return credentials[0] if credentials else None
+
+
+def _run_kdf(func, *args, **kwargs):
+    """Run a password hash function without stalling the gevent hub.
+
+    Once gevent has patched threading, ordinary thread pools run on greenlets
+    and the hash would still block every other request. gevent's hub thread
+    pool uses real OS threads, and hashlib's scrypt releases the GIL while it
+    works. Without gevent the hash simply runs in the calling thread.
+    """
+    if gevent_monkey is not None and gevent_monkey.is_module_patched("threading"):
+        return gevent.get_hub().threadpool.apply(func, args, kwargs)
+    return func(*args, **kwargs)
+
+
+def _hash_password(password: str) -> str:
+    return _run_kdf(generate_password_hash, password, method=PASSWORD_HASH_METHOD)
+
+
+def _check_password_cached(username: str, password_hash: str, password: str) -> bool:
+    digest = hmac.new(_AUTH_CACHE_KEY, password.encode("utf-8"), hashlib.sha256).digest()
+    key = (username, password_hash, digest)
+    now = time.monotonic()
+    with _AUTH_CACHE_LOCK:
+        cached = _AUTH_CACHE.get(key)
+    if cached is not None:
+        checked_at, valid = cached
+        if now - checked_at < (AUTH_CACHE_TTL if valid else AUTH_FAILURE_TTL):
+            return valid
+
+    valid = _run_kdf(check_password_hash, password_hash, password)
+    with _AUTH_CACHE_LOCK:
+        _AUTH_CACHE.pop(key, None)
+        _AUTH_CACHE[key] = (now, valid)
+        while len(_AUTH_CACHE) > AUTH_CACHE_SIZE:
+            del _AUTH_CACHE[next(iter(_AUTH_CACHE))]
+    return valid
+
+
+def authenticate_user(username: str, password: str) -> Optional[UserRow]:
+    credentials = _get_credentials(username)
+    if not credentials:
         return None
-    password_hash = user.pop("password_hash", None)
-    if not password_hash or not check_password_hash(password_hash, password):
+    user, password_hash = credentials
+    if not password_hash or not _check_password_cached(user.username, password_hash, password):
         return None
+    if not password_hash.startswith(PASSWORD_HASH_METHOD + ":"):
+        connection = get_connection()
+        connection.execute(
+            "UPDATE users SET password_hash = ? WHERE id = ?",
+            (_hash_password(password), user.id),
+        )
+        connection.commit()
     return user
 
 
-def create_user(username: str, password: str, is_admin: bool = False) -> Dict[str, object]:
+def create_user(username: str, password: str, is_admin: bool = False) -> UserRow:
     connection = get_connection()
+    username = username.strip()
+    insert = "INSERT INTO users (username, password_hash, is_admin) VALUES (?, ?, ?)"
+    if _HAS_RETURNING:
+        insert += f" RETURNING {_USER_COLUMNS}"
     try:
-        connection.execute(
-            "INSERT INTO users (username, password_hash, is_admin) VALUES (?, ?, ?)",
-            (username.strip(), generate_password_hash(password), int(is_admin)),
-        )
+        row = connection.execute(
+            insert, (username, _hash_password(password), int(is_admin))
+        ).fetchone()
     except sqlite3.IntegrityError as exc:
         raise ValueError("El nombre de usuario ya existe.") from exc
     connection.commit()
+    if _HAS_RETURNING:
+        return _row_to_user(row)
     created = get_user_by_username(username)
     if not created:
         raise RuntimeError("No se pudo crear el usuario.")
-    created.pop("password_hash", None)
     return created
 
 
+@contextmanager
+def _immediate_transaction(connection: sqlite3.Connection) -> Iterator[sqlite3.Connection]:
+    """Run the block in a single write transaction, committed once at the end."""
+    if connection.in_transaction:
+        connection.commit()
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        yield connection
+    except BaseException:
+        connection.rollback()
+        raise
+    connection.commit()
+
+
 def update_user(
     user_id: int,
     *,
     password: Optional[str] = None,
     is_admin: Optional[bool] = None,
-) -> Dict[str, object]:
+) -> UserRow:
     connection = get_connection()
-    if password is not None and password:
-        connection.execute(
-            "UPDATE users SET password_hash = ? WHERE id = ?",
-            (generate_password_hash(password), user_id),
-        )
-    if is_admin is not None:
-        _ensure_admin_integrity(user_id, is_admin)
-        connection.execute(
-            "UPDATE users SET is_admin = ? WHERE id = ?",
-            (int(is_admin), user_id),
-        )
-    connection.commit()
+    # Hash outside the write lock: key derivation is the slow part.
+    password_hash = _hash_password(password) if password else None
+    with _immediate_transaction(connection):
+        if is_admin is not None:
+            _ensure_admin_integrity(user_id, is_admin)
+        if password_hash is not None:
+            connection.execute(
+                "UPDATE users SET password_hash = ? WHERE id = ?",
+                (password_hash, user_id),
+            )
+        if is_admin is not None:
+            connection.execute(
+                "UPDATE users SET is_admin = ? WHERE id = ?",
+                (int(is_admin), user_id),
+            )
+    _invalidate_user(user_id)
     updated = get_user_by_id(user_id)
     if not updated:
         raise ValueError("Usuario no encontrado")
@@ -145,32 +343,29 @@ def update_user(
 
 
 def delete_user(user_id: int) -> None:
-    _ensure_admin_integrity(user_id, removing=True)
     connection = get_connection()
-    connection.execute("DELETE FROM users WHERE id = ?", (user_id,))
-    connection.commit()
+    with _immediate_transaction(connection):
+        _ensure_admin_integrity(user_id, removing=True)
+        connection.execute("DELETE FROM users WHERE id = ?", (user_id,))
+    _invalidate_user(user_id)
 
 
 def _ensure_admin_integrity(user_id: int, is_admin: Optional[bool] = None, removing: bool = False) -> None:
     connection = get_connection()
     row = connection.execute(
-        "SELECT is_admin FROM users WHERE id = ?",
-        (user_id,),
+        "SELECT is_admin, (SELECT COUNT(*) FROM users WHERE is_admin = 1 AND id != ?) "
+        "FROM users WHERE id = ?",
+        (user_id, user_id),
     ).fetchone()
     if row is None:
         raise ValueError("Usuario no encontrado")
-    was_admin = bool(row["is_admin"])
+    was_admin, other_admin_count = bool(row[0]), row[1]
     will_be_admin = was_admin if is_admin is None else is_admin
     if removing:
         will_be_admin = False
 
-    if was_admin and not will_be_admin:
-        admin_count = connection.execute(
-            "SELECT COUNT(*) FROM users WHERE is_admin = 1 AND id != ?",
-            (user_id,),
-        ).fetchone()[0]
-        if admin_count == 0:
-            raise ValueError("Debe existir al menos un usuario administrador.")
+    if was_admin and not will_be_admin and other_admin_count == 0:
+        raise ValueError("Debe existir al menos un usuario administrador.")
 
 
 def ensure_default_admin() -> None:
@@ -181,6 +376,6 @@ def ensure_default_admin() -> None:
 
 
 def count_users() -> int:
-    connection = get_connection()
+    connection = get_ro_connection()
     return connection.execute("SELECT COUNT(*) FROM users").fetchone()[0]
 
@@ -1,8 +1,9 @@
 """Blueprint para autenticación y gestión de usuarios."""
 from __future__ import annotations
 
+import time
 from functools import wraps
-from typing import Callable, Optional
+from typing import Callable, Dict, Optional
 
 from flask import (
     Blueprint,
@@ -19,14 +20,47 @@ from .. import db
 
 bp = Blueprint("auth", __name__, url_prefix="/auth")
 
+# Segundos durante los que se confía en los datos del usuario guardados en la
+# sesión (cookie firmada) antes de volver a comprobarlos en la base de datos.
+SESSION_USER_MAX_AGE = 300
+
+
+def _remember_user(user: db.UserRow) -> Dict[str, object]:
+    """Guarda en la sesión los datos mínimos del usuario y los devuelve."""
+    session_user = {
+        "id": user.id,
+        "username": user.username,
+        "is_admin": user.is_admin,
+        "checked_at": time.time(),
+    }
+    session["user_id"] = user.id
+    session["user"] = session_user
+    return session_user
+
+
+def _reload_user(user_id) -> Optional[Dict[str, object]]:
+    user = db.get_user_by_id(user_id)
+    if user is None:
+        session.pop("user", None)
+        return None
+    return _remember_user(user)
+
 
 @bp.before_app_request
 def load_logged_in_user() -> None:
+    if request.endpoint == "static":
+        # Los ficheros estáticos no necesitan el usuario: se evita la consulta.
+        g.user = None
+        return
+    session_user = session.get("user")
+    if session_user and time.time() - session_user.get("checked_at", 0) < SESSION_USER_MAX_AGE:
+        g.user = session_user
+        return
     user_id = session.get("user_id")
     if user_id is None:
         g.user = None
     else:
-        g.user = db.get_user_by_id(user_id)
+        g.user = _reload_user(user_id)
 
 
 def login_required(view: Callable) -> Callable:
@@ -71,7 +105,7 @@ def login():
                 error = "Credenciales inválidas."
             else:
                 session.clear()
-                session["user_id"] = user["id"]
+                _remember_user(user)
                 flash("Sesión iniciada correctamente.")
                 next_url = request.args.get("next")
                 if next_url and next_url.startswith("/"):
@@ -97,6 +131,11 @@ def logout():
 @admin_required
 def manage_users():
     if request.method == "POST":
+        # Los cambios de usuarios se validan contra la base de datos, no contra la sesión.
+        g.user = _reload_user(g.user["id"])
+        if g.user is None or not g.user.get("is_admin"):
+            flash("No tienes permisos para realizar esta acción.")
+            return redirect(url_for("main.index"))
         action = request.form.get("action")
         try:
             if action == "create":
@@ -117,7 +156,9 @@ def manage_users():
                 password_confirm = request.form.get("password_confirm") or None
                 if password and password != password_confirm:
                     raise ValueError("Las contraseñas no coinciden.")
-                db.update_user(user_id, password=password if password else None, is_admin=is_admin)
+                updated = db.update_user(user_id, password=password if password else None, is_admin=is_admin)
+                if g.user["id"] == user_id:
+                    g.user = _remember_user(updated)
                 flash("Usuario actualizado.")
             elif action == "delete":
                 user_id = int(request.form.get("user_id") or 0)
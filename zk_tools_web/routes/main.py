@@ -1,10 +1,28 @@
 """Vistas principales de la aplicación web."""
 from __future__ import annotations
 
+import hashlib
 import logging
-from typing import Dict, List, Set
+from dataclasses import dataclass, field
+from datetime import datetime
+from functools import cached_property, partial
+from operator import itemgetter
+from typing import Callable, Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
 
-from flask import Blueprint, flash, redirect, render_template, request, session, url_for
+from flask import (
+    Blueprint,
+    current_app,
+    flash,
+    g,
+    jsonify,
+    make_response,
+    redirect,
+    render_template,
+    request,
+    session,
+    url_for,
+)
+from flask.typing import ResponseReturnValue
 
 from .. import services
 from .auth import login_required
@@ -13,439 +31,695 @@ bp = Blueprint("main", __name__)
 
 logger = logging.getLogger(__name__)
 
+_get_uid = itemgetter("uid")
 
-@bp.route("/", methods=["GET", "POST"])
-@login_required
-def index():
-    """Página principal para administrar empleados."""
-    terminal_value_raw = request.values.get("terminal")
+_TRUTHY_VALUES = frozenset({"1", "true", "on", "yes"})
+_FALSY_VALUES = frozenset({"0", "false", "off", "no"})
+
+# Campos externos que se copian al empleado: (origen, destino, admite vacío,
+# sobrescribe). Los datos por User ID prevalecen; los de DNI solo rellenan huecos.
+_EXTERNAL_BY_ID_FIELDS = (
+    ("cod_ct", "center", False, True),
+    ("contract_from", "contract_from", False, True),
+    ("medical_leave_from", "medical_leave_from", False, True),
+    ("vacation_status", "vacation_status", True, True),
+    ("dni", "dni", False, False),
+)
+_EXTERNAL_BY_DNI_FIELDS = (
+    ("cod_ct", "center", False),
+    ("contract_from", "contract_from", False),
+    ("medical_leave_from", "medical_leave_from", False),
+    ("vacation_status", "vacation_status", True),
+)
+
+
+def _build_index_etag(
+    cache_key: Optional[str],
+    terminal_value: str,
+    expand_details: bool,
+    selected: Iterable[str],
+    known_terminal_ips: Tuple[str, ...],
+) -> str:
+    """Calcula la huella de la página principal para responder 304 si no ha cambiado."""
+    user = g.get("user") or {}
+    fingerprint = (
+        services.get_cached_employees_version(cache_key),
+        user.get("id"),
+        user.get("is_admin"),
+        terminal_value,
+        expand_details,
+        tuple(sorted(selected)),
+        known_terminal_ips,
+        # Versión del contenido, no la hora de descarga: una lista externa vacía
+        # se vuelve a descargar en cada petición sin que cambie la página.
+        services.get_external_employees_version(),
+        # Los tiempos relativos ("hace 5 minutos") caducan con el reloj.
+        datetime.now().strftime("%Y%m%d%H%M"),
+    )
+    return hashlib.blake2b(repr(fingerprint).encode("utf-8"), digest_size=16).hexdigest()
+
+
+@bp.app_template_filter("contract_date")
+def _contract_date_filter(value) -> str:
+    """Muestra una fecha de contrato o baja en formato ``ddMonyy``."""
+    return services.format_contract_date(value)
+
+
+@bp.app_template_filter("vacation_status")
+def _vacation_status_filter(value) -> str:
+    """Muestra el estado de vacaciones sin espacios sobrantes."""
+    return str(value or "").strip()
+
+
+def _get_index_template():
+    """Devuelve la plantilla principal compilada, resolviéndola una sola vez por aplicación."""
+    env = current_app.jinja_env
+    if env.auto_reload:
+        return "index.html"
+    template = current_app.extensions.get("zk_tools_index_template")
+    if template is None:
+        template = env.get_template("index.html")
+        current_app.extensions["zk_tools_index_template"] = template
+    return template
+
+
+@dataclass
+class IndexRequest:
+    """Datos de la petición a la página principal que necesitan las acciones."""
+
+    ip: Optional[str]
+    port: int
+    cache_key: Optional[str]
+    terminal_value: str
+    special_terminal_value: Optional[str]
+    is_special_selection: bool
+    is_database_selection: bool
+    is_zktime_selection: bool
+    expand_details: bool
+    # UID enviados que siguen en la caché; ``has_selection`` indica si se envió alguno.
+    selected_uids: FrozenSet[str] = frozenset()
+    has_selection: bool = False
+    override_employees: Optional[List[dict]] = None
+    terminal_status: Optional[dict] = None
+    terminal_status_errors: List[str] = field(default_factory=list)
+
+    @cached_property
+    def cached_employees(self) -> List[dict]:
+        """Empleados en memoria para ``cache_key``, leídos una sola vez por petición."""
+        return services.get_cached_employees(self.cache_key) if self.cache_key else []
+
+    def forget_cached_employees(self) -> None:
+        """Descarta la lectura anterior tras modificar la caché del terminal."""
+        self.__dict__.pop("cached_employees", None)
+
+    @cached_property
+    def formatted_terminal(self) -> str:
+        """Terminal seleccionado como ``ip[:puerto]``, o cadena vacía si no hay IP."""
+        return services.format_terminal_value(self.ip, self.port)
+
+    @cached_property
+    def redirect_terminal(self) -> str:
+        """Valor de ``terminal`` para las redirecciones tras una acción.
+
+        Solo se calcula si una acción redirige, así las peticiones GET no lo pagan.
+        """
+        if self.is_special_selection:
+            return self.special_terminal_value
+        return self.formatted_terminal or self.terminal_value
+
+    def redirect(self):
+        """Redirige a la página principal conservando el terminal seleccionado."""
+        if self.redirect_terminal:
+            return redirect(
+                url_for(
+                    "main.index",
+                    terminal=self.redirect_terminal,
+                    expand_details="1" if self.expand_details else "0",
+                )
+            )
+        return redirect(url_for("main.index", expand_details="1" if self.expand_details else "0"))
+
+
+# Cada acción devuelve la respuesta a enviar o ``None`` para mostrar la página.
+ActionHandler = Callable[[IndexRequest], Optional[ResponseReturnValue]]
+
+
+def _handle_import(ctx: IndexRequest):
+    if not ctx.cache_key or ctx.is_special_selection:
+        flash("Debes indicar un terminal para importar empleados.")
+        return ctx.redirect()
+    try:
+        imported_employees = services.parse_employee_file(request.files.get("employee_file"))
+    except ValueError as exc:
+        flash(str(exc))
+    else:
+        services.set_cached_employees(ctx.cache_key, imported_employees)
+        ctx.forget_cached_employees()
+        services.set_selected_uids(ctx.cache_key, set())
+        flash(
+            f"Se importaron {len(imported_employees)} empleado(s) en memoria para el terminal {ctx.ip}."
+        )
+    return ctx.redirect()
+
+
+def _handle_fetch(ctx: IndexRequest):
+    if ctx.is_special_selection:
+        special_terminal_value = ctx.special_terminal_value
+        source_label = services.get_special_terminal_label(special_terminal_value) or "la fuente seleccionada"
+        try:
+            if ctx.is_database_selection:
+                employees = services.refresh_database_cache()
+            elif ctx.is_zktime_selection:
+                employees = services.refresh_zktime_cache()
+            else:
+                raise RuntimeError("El origen seleccionado no está soportado.")
+        except Exception as exc:
+            logger.exception(
+                "Error al refrescar la caché de empleados para %s: %s",
+                special_terminal_value,
+                exc,
+            )
+            flash(f"No se pudo actualizar la relación de {source_label}: {exc}")
+        else:
+            flash(f"Se cargaron {len(employees)} empleado(s) desde {source_label}.")
+        return ctx.redirect()
+    ip = ctx.ip
+    if not ip:
+        flash("Debes indicar un terminal para cargar empleados.")
+        return ctx.redirect()
+    try:
+        # La consulta pedida por el usuario siempre lee el terminal; la caché de
+        # lecturas queda para la precarga en segundo plano.
+        employees = services.fetch_employees_cached(ip, ctx.port, force_refresh=True)
+    except Exception as exc:  # pragma: no cover - dependiente del dispositivo
+        logger.exception("Error al consultar empleados del terminal %s", ip)
+        flash(f"No se pudo obtener la información del terminal {ip}: {exc}")
+    else:
+        services.set_cached_employees(ip, employees)
+        ctx.forget_cached_employees()
+        services.start_warm_refresh(ip, ctx.port, employees)
+    return ctx.redirect()
+
+
+def _handle_select(ctx: IndexRequest):
+    if not ctx.cache_key:
+        return None
+    services.set_selected_uids(ctx.cache_key, ctx.selected_uids)
+    return ctx.redirect()
+
+
+def _handle_status(ctx: IndexRequest):
+    if ctx.is_special_selection:
+        flash("Esta opción no dispone de estado de terminal.")
+        return ctx.redirect()
+    if not ctx.ip:
+        flash("Debes indicar un terminal para consultar su estado.")
+        return ctx.redirect()
+    try:
+        ctx.terminal_status, ctx.terminal_status_errors = services.get_terminal_status(ctx.ip, ctx.port)
+    except Exception as exc:  # pragma: no cover - dependiente del dispositivo
+        logger.exception("Error al obtener el estado del terminal %s", ctx.ip)
+        flash(f"No se pudo obtener el estado del terminal: {exc}")
+        return ctx.redirect()
+    return None
+
+
+def _handle_sync_time(ctx: IndexRequest):
+    if not ctx.ip:
+        flash("Debes indicar un terminal para actualizar la hora.")
+        return ctx.redirect()
+    try:
+        services.sync_terminal_time(ctx.ip, ctx.port)
+    except Exception as exc:  # pragma: no cover - dependiente del dispositivo
+        logger.exception("Error al sincronizar la hora del terminal %s", ctx.ip)
+        flash(f"No se pudo sincronizar la fecha y hora: {exc}")
+    else:
+        flash("Fecha y hora sincronizadas con éxito.")
+    return ctx.redirect()
+
+
+def _handle_push(ctx: IndexRequest):
+    ip = ctx.ip
+    if not ip:
+        flash("Debes indicar un terminal para enviar empleados.")
+        return ctx.redirect()
+    selected_uids = ctx.selected_uids
+    if not ctx.has_selection:
+        flash("Selecciona al menos un empleado para enviar.")
+        return ctx.redirect()
+
+    cached_employees = ctx.cached_employees
+    if not cached_employees:
+        flash("No hay empleados en memoria para enviar. Carga o importa primero los empleados.")
+        return ctx.redirect()
+
+    selected_employees = services.get_cached_employees_by_uids(ip, selected_uids)
+    if not selected_employees:
+        flash(
+            "Los empleados seleccionados no están disponibles en caché. Consulta nuevamente el terminal."
+        )
+        return ctx.redirect()
+
+    services.set_selected_uids(ip, selected_uids)
+    try:
+        uploaded, errors = services.upload_employees(ip, selected_employees, port=ctx.port)
+    except Exception as exc:  # pragma: no cover - dependiente del dispositivo
+        logger.exception("Error al enviar empleados al terminal %s", ip)
+        flash(f"No se pudieron enviar los empleados seleccionados: {exc}")
+    else:
+        if uploaded:
+            flash(f"Se enviaron {len(uploaded)} empleado(s) al terminal.")
+        if errors:
+            for uid, message in errors:
+                flash(f"No se pudo enviar el empleado {uid}: {message}")
+    return ctx.redirect()
+
+
+def _handle_delete(ctx: IndexRequest):
+    ip = ctx.ip
+    if not ip:
+        return None
+    selected_uids = ctx.selected_uids
+    if not ctx.has_selection:
+        flash("Selecciona al menos un empleado para eliminar.")
+        return ctx.redirect()
+
+    cached_employees = ctx.cached_employees
+    to_delete = services.get_cached_employees_by_uids(ip, selected_uids)
+
+    if not to_delete:
+        flash(
+            "Los empleados seleccionados no están disponibles en caché. Consulta nuevamente el terminal."
+        )
+        return ctx.redirect()
+
+    try:
+        deleted, errors = services.delete_employees(ip, to_delete, port=ctx.port)
+    except Exception as exc:  # pragma: no cover - dependiente del dispositivo
+        logger.exception("Error al eliminar empleados del terminal %s", ip)
+        flash(f"No se pudieron eliminar los empleados seleccionados: {exc}")
+    else:
+        if deleted:
+            flash(f"Se eliminaron {len(deleted)} empleado(s) del terminal.")
+            deleted_uids = set(deleted)
+            remaining = [
+                emp for emp in cached_employees if emp.get("uid") not in deleted_uids
+            ]
+            services.set_cached_employees(ip, remaining)
+            ctx.forget_cached_employees()
+            services.remove_selected_uids(ip, deleted)
+        if errors:
+            for uid, message in errors:
+                flash(f"No se pudo eliminar el empleado {uid}: {message}")
+    return ctx.redirect()
+
+
+def _handle_export(ctx: IndexRequest, export_format: str):
+    cache_key = ctx.cache_key
+    if not cache_key:
+        return None
+    selected_uids = ctx.selected_uids
+    if not ctx.has_selection:
+        flash("Selecciona al menos un empleado para exportar.")
+        return ctx.redirect()
+
+    cached_employees = ctx.cached_employees
+    if not cached_employees:
+        flash("No hay empleados en caché para exportar. Consulta primero la fuente de empleados.")
+        return ctx.redirect()
+
+    selected_employees = services.get_cached_employees_by_uids(cache_key, selected_uids)
+    if not selected_employees:
+        flash(
+            "Los empleados seleccionados no están disponibles en caché. Consulta nuevamente el terminal."
+        )
+        return ctx.redirect()
+
+    services.set_selected_uids(cache_key, selected_uids)
+    source_label = services.get_special_terminal_label(cache_key)
+    export_host = (
+        source_label.replace(" ", "_")
+        if source_label
+        else (ctx.ip or services.DATABASE_TERMINAL_LABEL.replace(" ", "_"))
+    )
+    try:
+        return services.build_export_response(export_host, selected_employees, export_format)
+    except ValueError as exc:
+        flash(str(exc))
+        return ctx.redirect()
+
+
+def _handle_clear(ctx: IndexRequest):
+    cache_key = ctx.cache_key
+    if not cache_key:
+        services.clear_all_cache()
+        services.invalidate_external_employees()
+        flash("Se limpiaron los empleados almacenados en memoria.")
+        return redirect(url_for("main.index"))
+    cached = services.clear_terminal_cache(cache_key)
+    ctx.forget_cached_employees()
+    removed_count = len(cached)
+    if removed_count:
+        if ctx.is_special_selection:
+            flash(
+                f"Se limpiaron {removed_count} empleado(s) en memoria."
+            )
+        else:
+            flash(
+                f"Se limpiaron {removed_count} empleado(s) del terminal {ctx.ip} en memoria."
+            )
+    else:
+        if ctx.is_special_selection:
+            flash("No había empleados almacenados en memoria.")
+        else:
+            flash("No había empleados almacenados en memoria para este terminal.")
+    return ctx.redirect()
+
+
+def _handle_duplicates(ctx: IndexRequest):
+    if not ctx.cache_key:
+        flash("Debes indicar una fuente de empleados para buscar duplicados.")
+        return ctx.redirect()
+    cached_employees = ctx.cached_employees
+    if not cached_employees:
+        flash("No hay empleados en memoria. Consulta primero la fuente seleccionada.")
+        return ctx.redirect()
+    duplicate_employees = services.find_duplicate_employees(cached_employees)
+    if duplicate_employees:
+        flash(
+            f"Se encontraron {len(duplicate_employees)} empleado(s) con el mismo nombre y distinto User ID."
+        )
+    else:
+        flash("No se encontraron empleados duplicados por nombre con distinto User ID.")
+    ctx.override_employees = duplicate_employees
+    return None
+
+
+def _start_card_update(ctx: IndexRequest, kind: str, label: str):
+    if not ctx.cache_key:
+        flash("Debes indicar una fuente de empleados para actualizar las tarjetas.")
+        return ctx.redirect()
+    cached_employees = ctx.cached_employees
+    if not cached_employees:
+        flash("No hay empleados en memoria. Consulta primero la fuente seleccionada.")
+        return ctx.redirect()
+    job_id = services.submit_card_update(kind, cached_employees)
+    session["update_log_job"] = job_id
+    flash(f"Se inició la actualización de tarjetas en {label}. El resultado se mostrará al terminar.")
+    return ctx.redirect()
+
+
+def _handle_update_cards_zktime(ctx: IndexRequest):
+    return _start_card_update(ctx, "zktime", "ZK Time")
+
+
+def _handle_update_cards_rrhh(ctx: IndexRequest):
+    return _start_card_update(ctx, "rrhh", "RRHH")
+
+
+def _zktime_update_log(result) -> dict:
+    updated_count, attempted, update_entries = result
+    log_entries = []
+    for code, card in update_entries:
+        status = "success" if updated_count else "info"
+        if status == "success":
+            text = f"Al empleado {code} se ha actualizado la tarjeta {card}."
+        else:
+            text = f"Se solicitó actualizar la tarjeta {card} del empleado {code}."
+        log_entries.append({"status": status, "text": text})
+    if updated_count:
+        summary = f"Se actualizaron {updated_count} tarjeta(s) en ZK Time."
+        flash(summary)
+    elif attempted:
+        summary = "Se encontraron tarjetas para actualizar, pero no se modificó ningún registro en ZK Time."
+        flash(summary)
+    else:
+        summary = "No hay tarjetas disponibles para actualizar."
+        flash(summary)
+    if not log_entries:
+        log_entries.append(
+            {
+                "status": "info",
+                "text": "No se encontraron tarjetas para actualizar.",
+            }
+        )
+    return {
+        "title": "Actualización de tarjetas en ZKTime",
+        "summary": summary,
+        "entries": log_entries,
+    }
+
+
+def _rrhh_update_log(result) -> dict:
+    updated_count, attempted, success_entries, errors = result
+    log_entries = [
+        {
+            "status": "success",
+            "text": f"Al empleado {code} se ha registrado la tarjeta {card}.",
+        }
+        for code, card in success_entries
+    ]
+    if updated_count:
+        summary = f"Se registraron {updated_count} tarjeta(s) en RRHH."
+        flash(summary)
+    elif attempted == 0:
+        summary = "No hay tarjetas disponibles para registrar en RRHH."
+        flash(summary)
+    else:
+        summary = "No se pudo registrar ninguna tarjeta en RRHH."
+        flash(summary)
+    for code, message in errors:
+        flash(f"No se pudo registrar la tarjeta del empleado {code}: {message}")
+        log_entries.append(
+            {
+                "status": "error",
+                "text": f"No se registró la tarjeta del empleado {code}: {message}",
+            }
+        )
+    if not log_entries:
+        log_entries.append(
+            {
+                "status": "info",
+                "text": "No se registró ninguna tarjeta.",
+            }
+        )
+    return {
+        "title": "Registro de tarjetas en RRHH",
+        "summary": summary,
+        "entries": log_entries,
+    }
+
+
+# Tipo de actualización -> (destino para los mensajes de error, constructor del registro).
+_CARD_UPDATE_LOGS: Dict[str, Tuple[str, Callable[[tuple], dict]]] = {
+    "zktime": ("ZK Time", _zktime_update_log),
+    "rrhh": ("RRHH", _rrhh_update_log),
+}
+
+
+def _collect_card_update() -> Tuple[Optional[str], Optional[dict]]:
+    """Recoge la actualización de tarjetas en curso de la sesión.
+
+    Devuelve ``(id, None)`` si sigue en marcha y ``(None, registro)`` si ya
+    terminó. El registro se pinta directamente y no pasa por la cookie de sesión,
+    que solo guarda el identificador del trabajo.
+    """
+    job_id = session.get("update_log_job")
+    if not job_id:
+        return None, None
+    job = services.get_card_update_job(job_id)
+    if job is None:
+        session.pop("update_log_job", None)
+        flash(
+            "No se encontró el resultado de la actualización de tarjetas. "
+            "Comprueba los datos y vuelve a lanzarla si es necesario."
+        )
+        return None, None
+    kind, future = job
+    if not future.done():
+        return job_id, None
+    session.pop("update_log_job", None)
+    services.forget_card_update_job(job_id)
+    label, build_log = _CARD_UPDATE_LOGS[kind]
+    try:
+        result = future.result()
+    except Exception as exc:  # pragma: no cover - dependiente del servicio externo
+        logger.error("Error al actualizar tarjetas en %s: %s", label, exc, exc_info=exc)
+        flash(f"No se pudieron actualizar las tarjetas en {label}: {exc}")
+        return None, None
+    return None, build_log(result)
+
+
+ACTIONS: Dict[str, ActionHandler] = {
+    "import": _handle_import,
+    "fetch": _handle_fetch,
+    "select": _handle_select,
+    "status": _handle_status,
+    "sync_time": _handle_sync_time,
+    "push": _handle_push,
+    "delete": _handle_delete,
+    "export_csv": partial(_handle_export, export_format="csv"),
+    "export_json": partial(_handle_export, export_format="json"),
+    "export_excel": partial(_handle_export, export_format="excel"),
+    "clear": _handle_clear,
+    "duplicates": _handle_duplicates,
+    "update_cards_zktime": _handle_update_cards_zktime,
+    "update_cards_rrhh": _handle_update_cards_rrhh,
+}
+
+
+def _collect_inputs() -> IndexRequest:
+    """Interpreta el terminal y las opciones recibidas en la petición."""
+    values = request.values
+    terminal_value_raw = values.get("terminal")
     terminal_value = (terminal_value_raw or "").strip()
     special_terminal_value = services.normalize_special_terminal_value(terminal_value)
     is_special_selection = special_terminal_value is not None
-    is_database_selection = special_terminal_value == services.DATABASE_TERMINAL_KEY
-    is_zktime_selection = special_terminal_value == services.ZKTIME_TERMINAL_KEY
 
     if is_special_selection:
         parsed_ip, parsed_port = (None, services.DEFAULT_PORT)
     else:
         parsed_ip, parsed_port = services.parse_terminal_value(terminal_value)
 
-    fallback_ip = (request.values.get("ip", "") or "").strip() or None
+    fallback_ip = (values.get("ip", "") or "").strip() or None
     ip = None if is_special_selection else parsed_ip or fallback_ip
     if is_special_selection:
         port = services.DEFAULT_PORT
     else:
-        port = parsed_port if parsed_ip else services.coerce_port(request.values.get("port"))
-
-    cache_key = special_terminal_value if is_special_selection else ip
+        port = parsed_port if parsed_ip else services.coerce_port(values.get("port"))
 
-    employees: List[dict] = []
-    selected: Set[str] = set()
-    override_employees: List[dict] | None = None
-    terminal_status = None
-    terminal_status_errors: List[str] = []
-    known_terminals = services.load_known_terminals()
-    known_terminal_ips = [item["ip"] for item in known_terminals]
-    expand_details_values = [
-        (value or "").lower() for value in request.values.getlist("expand_details") if value is not None
-    ]
-    if not expand_details_values:
-        expand_details = True
-    else:
-        truthy_values = {"1", "true", "on"}
-        falsy_values = {"0", "false", "off"}
-        if any(value in truthy_values for value in expand_details_values):
+    # El formulario envía un campo oculto "0" junto a la casilla, así que
+    # cualquier valor afirmativo prevalece sobre los negativos.
+    expand_details = True
+    for value in values.getlist("expand_details"):
+        value = (value or "").lower()
+        if value in _TRUTHY_VALUES:
             expand_details = True
-        elif any(value in falsy_values for value in expand_details_values):
+            break
+        if value in _FALSY_VALUES:
             expand_details = False
-        else:
-            expand_details = True
 
-    def redirect_with_terminal():
-        redirect_params = {}
-        if is_special_selection and special_terminal_value:
-            redirect_params["terminal"] = special_terminal_value
-        else:
-            terminal_param = services.format_terminal_value(ip, port)
-            if terminal_param:
-                redirect_params["terminal"] = terminal_param
-            fallback_terminal = terminal_value
-            if fallback_terminal:
-                redirect_params.setdefault("terminal", fallback_terminal)
-        redirect_params["expand_details"] = "1" if expand_details else "0"
-        return redirect(url_for("main.index", **redirect_params))
-
-    if request.method == "POST":
-        action = request.form.get("action")
-        if action == "import" and cache_key and not is_special_selection:
-            try:
-                imported_employees = services.parse_employee_file(request.files.get("employee_file"))
-            except ValueError as exc:
-                flash(str(exc))
-            else:
-                services.set_cached_employees(cache_key, imported_employees)
-                services.set_selected_uids(cache_key, set())
-                flash(
-                    f"Se importaron {len(imported_employees)} empleado(s) en memoria para el terminal {ip}."
-                )
-            return redirect_with_terminal()
-        if action == "import":
-            flash("Debes indicar un terminal para importar empleados.")
-            return redirect_with_terminal()
-        if action == "fetch" and is_special_selection:
-            source_label = services.get_special_terminal_label(special_terminal_value) or "la fuente seleccionada"
-            try:
-                if is_database_selection:
-                    employees = services.refresh_database_cache()
-                elif is_zktime_selection:
-                    employees = services.refresh_zktime_cache()
-                else:
-                    raise RuntimeError("El origen seleccionado no está soportado.")
-            except Exception as exc:
-                logger.exception(
-                    "Error al refrescar la caché de empleados para %s: %s",
-                    special_terminal_value,
-                    exc,
-                )
-                flash(f"No se pudo actualizar la relación de {source_label}: {exc}")
-            else:
-                flash(f"Se cargaron {len(employees)} empleado(s) desde {source_label}.")
-            return redirect_with_terminal()
-        if action == "fetch" and ip:
-            try:
-                employees = services.fetch_employees(ip, port)
-            except Exception as exc:  # pragma: no cover - dependiente del dispositivo
-                logger.exception("Error al consultar empleados del terminal %s", ip)
-                flash(f"No se pudo obtener la información del terminal {ip}: {exc}")
-            else:
-                services.set_cached_employees(ip, employees)
-                selected = services.get_selected_uids(ip)
-            return redirect_with_terminal()
-        if action == "fetch":
-            flash("Debes indicar un terminal para cargar empleados.")
-            return redirect_with_terminal()
-        if action == "select" and cache_key:
-            selected_uids = set(request.form.getlist("selected"))
-            services.set_selected_uids(cache_key, selected_uids)
-            return redirect_with_terminal()
-        if action == "status" and is_special_selection:
-            flash("Esta opción no dispone de estado de terminal.")
-            return redirect_with_terminal()
-        if action == "status" and ip:
-            try:
-                terminal_status, terminal_status_errors = services.get_terminal_status(ip, port)
-            except Exception as exc:  # pragma: no cover - dependiente del dispositivo
-                logger.exception("Error al obtener el estado del terminal %s", ip)
-                flash(f"No se pudo obtener el estado del terminal: {exc}")
-                return redirect_with_terminal()
-        if action == "status":
-            if not ip:
-                flash("Debes indicar un terminal para consultar su estado.")
-                return redirect_with_terminal()
-        if action == "sync_time" and ip:
-            try:
-                services.sync_terminal_time(ip, port)
-            except Exception as exc:  # pragma: no cover - dependiente del dispositivo
-                logger.exception("Error al sincronizar la hora del terminal %s", ip)
-                flash(f"No se pudo sincronizar la fecha y hora: {exc}")
-            else:
-                flash("Fecha y hora sincronizadas con éxito.")
-            return redirect_with_terminal()
-        if action == "sync_time":
-            flash("Debes indicar un terminal para actualizar la hora.")
-            return redirect_with_terminal()
-        if action == "push" and ip:
-            selected_uids = set(request.form.getlist("selected"))
-            if not selected_uids:
-                flash("Selecciona al menos un empleado para enviar.")
-                return redirect_with_terminal()
-
-            cached_employees = services.get_cached_employees(ip)
-            if not cached_employees:
-                flash("No hay empleados en memoria para enviar. Carga o importa primero los empleados.")
-                return redirect_with_terminal()
-
-            selected_employees = [
-                emp for emp in cached_employees if emp.get("uid") in selected_uids
-            ]
-            if not selected_employees:
-                flash(
-                    "Los empleados seleccionados no están disponibles en caché. Consulta nuevamente el terminal."
-                )
-                return redirect_with_terminal()
-
-            services.set_selected_uids(ip, selected_uids)
-            try:
-                uploaded, errors = services.upload_employees(ip, selected_employees, port=port)
-            except Exception as exc:  # pragma: no cover - dependiente del dispositivo
-                logger.exception("Error al enviar empleados al terminal %s", ip)
-                flash(f"No se pudieron enviar los empleados seleccionados: {exc}")
-            else:
-                if uploaded:
-                    flash(f"Se enviaron {len(uploaded)} empleado(s) al terminal.")
-                if errors:
-                    for uid, message in errors:
-                        flash(f"No se pudo enviar el empleado {uid}: {message}")
-            return redirect_with_terminal()
-        if action == "push":
-            flash("Debes indicar un terminal para enviar empleados.")
-            return redirect_with_terminal()
-        if action == "delete" and ip:
-            selected_uids = set(request.form.getlist("selected"))
-            if not selected_uids:
-                flash("Selecciona al menos un empleado para eliminar.")
-                return redirect_with_terminal()
-
-            cached_employees = services.get_cached_employees(ip)
-            to_delete = [emp for emp in cached_employees if emp.get("uid") in selected_uids]
-
-            if not to_delete:
-                flash(
-                    "Los empleados seleccionados no están disponibles en caché. Consulta nuevamente el terminal."
-                )
-                return redirect_with_terminal()
+    return IndexRequest(
+        ip=ip,
+        port=port,
+        cache_key=special_terminal_value if is_special_selection else ip,
+        terminal_value=terminal_value,
+        special_terminal_value=special_terminal_value,
+        is_special_selection=is_special_selection,
+        is_database_selection=special_terminal_value == services.DATABASE_TERMINAL_KEY,
+        is_zktime_selection=special_terminal_value == services.ZKTIME_TERMINAL_KEY,
+        expand_details=expand_details,
+    )
 
-            try:
-                deleted, errors = services.delete_employees(ip, to_delete, port=port)
-            except Exception as exc:  # pragma: no cover - dependiente del dispositivo
-                logger.exception("Error al eliminar empleados del terminal %s", ip)
-                flash(f"No se pudieron eliminar los empleados seleccionados: {exc}")
-            else:
-                if deleted:
-                    flash(f"Se eliminaron {len(deleted)} empleado(s) del terminal.")
-                    remaining = [
-                        emp for emp in cached_employees if emp.get("uid") not in deleted
-                    ]
-                    services.set_cached_employees(ip, remaining)
-                    services.remove_selected_uids(ip, deleted)
-                if errors:
-                    for uid, message in errors:
-                        flash(f"No se pudo eliminar el empleado {uid}: {message}")
-            return redirect_with_terminal()
-        if action in {"export_csv", "export_json", "export_excel"} and cache_key:
-            selected_uids = set(request.form.getlist("selected"))
-            if not selected_uids:
-                flash("Selecciona al menos un empleado para exportar.")
-                return redirect_with_terminal()
-
-            cached_employees = services.get_cached_employees(cache_key)
-            if not cached_employees:
-                flash("No hay empleados en caché para exportar. Consulta primero la fuente de empleados.")
-                return redirect_with_terminal()
-
-            selected_employees = [
-                emp for emp in cached_employees if emp.get("uid") in selected_uids
-            ]
-            if not selected_employees:
-                flash(
-                    "Los empleados seleccionados no están disponibles en caché. Consulta nuevamente el terminal."
-                )
-                return redirect_with_terminal()
-
-            services.set_selected_uids(cache_key, selected_uids)
-            export_format = action.split("_", 1)[1]
-            source_label = services.get_special_terminal_label(cache_key)
-            export_host = (
-                source_label.replace(" ", "_")
-                if source_label
-                else (ip or services.DATABASE_TERMINAL_LABEL.replace(" ", "_"))
-            )
-            try:
-                return services.build_export_response(export_host, selected_employees, export_format)
-            except ValueError as exc:
-                flash(str(exc))
-                return redirect_with_terminal()
-        if action == "clear":
-            if cache_key:
-                cached = services.clear_terminal_cache(cache_key)
-                removed_count = len(cached)
-                if removed_count:
-                    if is_special_selection:
-                        flash(
-                            f"Se limpiaron {removed_count} empleado(s) en memoria."
-                        )
-                    else:
-                        flash(
-                            f"Se limpiaron {removed_count} empleado(s) del terminal {ip} en memoria."
-                        )
-                else:
-                    if is_special_selection:
-                        flash("No había empleados almacenados en memoria.")
-                    else:
-                        flash("No había empleados almacenados en memoria para este terminal.")
-                return redirect_with_terminal()
-            services.clear_all_cache()
-            flash("Se limpiaron los empleados almacenados en memoria.")
-            return redirect(url_for("main.index"))
-        if action == "duplicates":
-            if not cache_key:
-                flash("Debes indicar una fuente de empleados para buscar duplicados.")
-                return redirect_with_terminal()
-            cached_employees = services.get_cached_employees(cache_key)
-            if not cached_employees:
-                flash("No hay empleados en memoria. Consulta primero la fuente seleccionada.")
-                return redirect_with_terminal()
-            duplicate_employees = services.find_duplicate_employees(cached_employees)
-            if duplicate_employees:
-                flash(
-                    f"Se encontraron {len(duplicate_employees)} empleado(s) con el mismo nombre y distinto User ID."
-                )
-            else:
-                flash("No se encontraron empleados duplicados por nombre con distinto User ID.")
-            override_employees = duplicate_employees
-        if action == "update_cards_zktime":
-            if not cache_key:
-                flash("Debes indicar una fuente de empleados para actualizar las tarjetas.")
-                return redirect_with_terminal()
-            cached_employees = services.get_cached_employees(cache_key)
-            if not cached_employees:
-                flash("No hay empleados en memoria. Consulta primero la fuente seleccionada.")
-                return redirect_with_terminal()
-            try:
-                updated_count, attempted, update_entries = services.update_zktime_cards(cached_employees)
-            except Exception as exc:
-                logger.exception("Error al actualizar tarjetas en ZK Time: %s", exc)
-                flash(f"No se pudieron actualizar las tarjetas en ZK Time: {exc}")
-            else:
-                log_entries = []
-                for code, card in update_entries:
-                    status = "success" if updated_count else "info"
-                    if status == "success":
-                        text = f"Al empleado {code} se ha actualizado la tarjeta {card}."
-                    else:
-                        text = f"Se solicitó actualizar la tarjeta {card} del empleado {code}."
-                    log_entries.append({"status": status, "text": text})
-                if updated_count:
-                    summary = f"Se actualizaron {updated_count} tarjeta(s) en ZK Time."
-                    flash(summary)
-                elif attempted:
-                    summary = "Se encontraron tarjetas para actualizar, pero no se modificó ningún registro en ZK Time."
-                    flash(summary)
-                else:
-                    summary = "No hay tarjetas disponibles para actualizar."
-                    flash(summary)
-                if not log_entries:
-                    log_entries.append(
-                        {
-                            "status": "info",
-                            "text": "No se encontraron tarjetas para actualizar.",
-                        }
-                    )
-                session["update_log"] = {
-                    "title": "Actualización de tarjetas en ZKTime",
-                    "summary": summary,
-                    "entries": log_entries,
-                }
-            return redirect_with_terminal()
-        if action == "update_cards_rrhh":
-            if not cache_key:
-                flash("Debes indicar una fuente de empleados para actualizar las tarjetas.")
-                return redirect_with_terminal()
-            cached_employees = services.get_cached_employees(cache_key)
-            if not cached_employees:
-                flash("No hay empleados en memoria. Consulta primero la fuente seleccionada.")
-                return redirect_with_terminal()
-            try:
-                updated_count, attempted, success_entries, errors = services.update_rrhh_cards(cached_employees)
-            except Exception as exc:  # pragma: no cover - dependiente del servicio externo
-                logger.exception("Error al actualizar tarjetas en RRHH: %s", exc)
-                flash(f"No se pudieron actualizar las tarjetas en RRHH: {exc}")
-            else:
-                log_entries = [
-                    {
-                        "status": "success",
-                        "text": f"Al empleado {code} se ha registrado la tarjeta {card}.",
-                    }
-                    for code, card in success_entries
-                ]
-                if updated_count:
-                    summary = f"Se registraron {updated_count} tarjeta(s) en RRHH."
-                    flash(summary)
-                elif attempted == 0:
-                    summary = "No hay tarjetas disponibles para registrar en RRHH."
-                    flash(summary)
-                else:
-                    summary = "No se pudo registrar ninguna tarjeta en RRHH."
-                    flash(summary)
-                for code, message in errors:
-                    flash(f"No se pudo registrar la tarjeta del empleado {code}: {message}")
-                    log_entries.append(
-                        {
-                            "status": "error",
-                            "text": f"No se registró la tarjeta del empleado {code}: {message}",
-                        }
-                    )
-                if not log_entries:
-                    log_entries.append(
-                        {
-                            "status": "info",
-                            "text": "No se registró ninguna tarjeta.",
-                        }
-                    )
-                session["update_log"] = {
-                    "title": "Registro de tarjetas en RRHH",
-                    "summary": summary,
-                    "entries": log_entries,
-                }
-            return redirect_with_terminal()
 
+def _dispatch_action(ctx: IndexRequest) -> Optional[ResponseReturnValue]:
+    """Ejecuta la acción enviada por POST; ``None`` indica que hay que mostrar la página."""
+    if request.method != "POST":
+        return None
+    form = request.form
+    handler = ACTIONS.get(form.get("action"))
+    if handler is None:
+        return None
+    posted_uids = form.getlist("selected")
+    ctx.has_selection = bool(posted_uids)
+    ctx.selected_uids = services.parse_selected_uids(posted_uids, ctx.cache_key)
+    return handler(ctx)
+
+
+@bp.route("/", methods=["GET", "POST"])
+@login_required
+def index():
+    """Página principal para administrar empleados."""
+    ctx = _collect_inputs()
+    response = _dispatch_action(ctx)
+    if response is not None:
+        return response
+    return _render_index(ctx)
+
+
+@bp.route("/update_log/<job_id>")
+@login_required
+def update_log_status(job_id: str):
+    """Indica si ha terminado una actualización de tarjetas lanzada en segundo plano."""
+    job = services.get_card_update_job(job_id)
+    if job is None:
+        return jsonify({"error": "Actualización de tarjetas desconocida."}), 404
+    return jsonify({"done": job[1].done()})
+
+
+def _render_index(ctx: IndexRequest):
+    """Prepara los empleados del terminal seleccionado y pinta la página principal."""
+    ip = ctx.ip
+    port = ctx.port
+    cache_key = ctx.cache_key
+    terminal_value = ctx.terminal_value
+    special_terminal_value = ctx.special_terminal_value
+    is_special_selection = ctx.is_special_selection
+    expand_details = ctx.expand_details
+    override_employees = ctx.override_employees
+    pending_card_update, update_log = _collect_card_update()
+
+    employees: List[dict] = []
+    selected: Set[str] = set()
+    known = services.get_known_terminals()
+    known_terminals = known.items
+    known_terminal_ips = known.ips
+
+    cached_employees = ctx.cached_employees
+    employee_map: Dict[str, dict]
     if override_employees is not None:
+        # Vista de duplicados: se filtra la selección para mostrarla, pero la
+        # guardada se conserva para cuando se vuelva a la lista completa.
         employees = override_employees
+        employee_map = dict(zip(map(_get_uid, employees), employees))
         if cache_key:
             selected = services.get_selected_uids(cache_key)
+            selected &= employee_map.keys()
     elif cache_key:
-        employees = services.get_cached_employees(cache_key)
+        employees = cached_employees
+        employee_map = services.get_cached_employee_map(cache_key)
         selected = services.get_selected_uids(cache_key)
+        selected_before = len(selected)
+        selected &= employee_map.keys()
+        # Solo se guarda la selección si se descartó algún UID que ya no existe.
+        if len(selected) != selected_before:
+            services.set_selected_uids(cache_key, selected)
+    else:
+        employee_map = {}
 
-    employee_map = {emp["uid"]: emp for emp in employees}
-    employee_uids = set(employee_map.keys())
-    selected = {uid for uid in selected if uid in employee_uids}
-    if cache_key:
-        services.set_selected_uids(cache_key, selected)
+    etag = None
+    external_version = services.get_external_employees_version()
+    if (
+        request.method == "GET"
+        and not session.get("_flashes")
+        and update_log is None
+        and pending_card_update is None
+    ):
+        etag = _build_index_etag(
+            cache_key, terminal_value, expand_details, selected, known_terminal_ips
+        )
+        if request.if_none_match.contains(etag):
+            response = current_app.response_class(status=304)
+            response.set_etag(etag)
+            return response
     total_employees = len(employees)
     selected_count = len(selected)
-    terminal_display = services.format_terminal_value(ip, port) if ip else ""
+    terminal_display = ctx.formatted_terminal
     if is_special_selection:
         terminal_display = services.get_special_terminal_label(special_terminal_value) or terminal_display
     elif not terminal_display and terminal_value:
         terminal_display = terminal_value.strip()
-    cached_employee_count = len(services.get_cached_employees(cache_key)) if cache_key else 0
+    cached_employee_count = len(cached_employees)
     external_employee_details: Dict[str, dict] = {}
     resolved_external_employee_details: Dict[str, dict] = {}
     employee_last_seen: Dict[str, str] = {}
 
+    user_lookup_map: Optional[Dict[str, dict]] = None
     if employees:
         try:
             user_lookup_map = services.get_external_employee_map()
         except Exception as exc:  # pragma: no cover - dependiente del servicio externo
             logger.exception("No se pudo obtener la información externa de empleados: %s", exc)
-        else:
-            for employee in employees:
-                user_id_value = employee.get("user_id")
-                details = services.lookup_external_employee(user_id_value, user_lookup_map)
-                last_seen_value = None
-                if details:
-                    center_value = details.get("cod_ct")
-                    if center_value:
-                        employee["center"] = center_value
-                    contract_from_value = details.get("contract_from")
-                    if contract_from_value:
-                        employee["contract_from"] = contract_from_value
-                    medical_leave_value = details.get("medical_leave_from")
-                    if medical_leave_value:
-                        employee["medical_leave_from"] = medical_leave_value
-                    vacation_status_value = details.get("vacation_status")
-                    if vacation_status_value is not None:
-                        employee["vacation_status"] = vacation_status_value
-                    dni_value = details.get("dni")
-                    if dni_value and not employee.get("dni"):
-                        employee["dni"] = dni_value
-                    last_seen_value = details.get("last_seen")
-                if not last_seen_value:
-                    last_seen_value = employee.get("last_seen")
-                if last_seen_value:
-                    formatted_last_seen = services.format_relative_time(last_seen_value)
-                    employee_last_seen[str(employee.get("uid"))] = formatted_last_seen
 
     if expand_details:
         try:
@@ -454,72 +728,113 @@ def index():
             logger.exception("No se pudo ampliar la información de empleados: %s", exc)
             flash("No se pudo obtener la información ampliada de empleados.")
             expand_details = False
-        else:
-            for employee in employees:
-                candidate_identifier = employee.get("dni") or employee.get("name")
-                details = services.lookup_external_employee(candidate_identifier, external_employee_details)
-                if details:
-                    resolved_external_employee_details[str(employee.get("uid"))] = details
-                    center_value = details.get("cod_ct")
-                    if center_value and not employee.get("center"):
-                        employee["center"] = center_value
-                    contract_from_value = details.get("contract_from")
-                    if contract_from_value and not employee.get("contract_from"):
-                        employee["contract_from"] = contract_from_value
-                    medical_leave_value = details.get("medical_leave_from")
-                    if medical_leave_value and not employee.get("medical_leave_from"):
-                        employee["medical_leave_from"] = medical_leave_value
-                    vacation_status_value = details.get("vacation_status")
-                    if vacation_status_value is not None and not employee.get("vacation_status"):
-                        employee["vacation_status"] = vacation_status_value
 
+    # Un único recorrido aplica primero los datos por User ID (que prevalecen) y
+    # después completa los huecos con los datos por DNI. El formato de fechas y
+    # vacaciones lo aplican los filtros de la plantilla.
+    lookup_external_employee = services.lookup_external_employee
+    # El texto relativo ("4 hours ago") depende de la hora: se memoriza solo en esta petición.
+    relative_times: Dict[str, str] = {}
     for employee in employees:
-        if not employee.get("center"):
-            employee["center"] = employee.get("group_id")
-        employee["contract_from_display"] = services.format_contract_date(employee.get("contract_from"))
-        employee["medical_leave_from_display"] = services.format_contract_date(
-            employee.get("medical_leave_from")
-        )
-        employee["vacation_status_display"] = str(employee.get("vacation_status") or "").strip()
+        get = employee.get
+        set_value = employee.__setitem__
+        uid_key = str(get("uid"))
+        if user_lookup_map is not None:
+            user_id_value = get("user_id")
+            # Las claves de los mapeos ya vienen recortadas: si el valor coincide tal
+            # cual se evita la llamada que prueba las variaciones.
+            details = user_lookup_map.get(user_id_value) if user_id_value else None
+            if details is None and user_lookup_map:
+                details = lookup_external_employee(user_id_value, user_lookup_map)
+            last_seen_value = None
+            if details:
+                details_get = details.get
+                for source, target, keep_empty, overwrite in _EXTERNAL_BY_ID_FIELDS:
+                    value = details_get(source)
+                    if value is None or not (value or keep_empty):
+                        continue
+                    if overwrite or not get(target):
+                        set_value(target, value)
+                last_seen_value = details_get("last_seen")
+            if not last_seen_value:
+                last_seen_value = get("last_seen")
+            if last_seen_value:
+                formatted_last_seen = relative_times.get(last_seen_value)
+                if formatted_last_seen is None:
+                    formatted_last_seen = services.format_relative_time(last_seen_value)
+                    relative_times[last_seen_value] = formatted_last_seen
+                employee_last_seen[uid_key] = formatted_last_seen
+
+        if expand_details and external_employee_details:
+            identifier = get("dni") or get("name")
+            details = external_employee_details.get(identifier) if identifier else None
+            if details is None:
+                details = lookup_external_employee(identifier, external_employee_details)
+            if details:
+                resolved_external_employee_details[uid_key] = details
+                details_get = details.get
+                for source, target, keep_empty in _EXTERNAL_BY_DNI_FIELDS:
+                    value = details_get(source)
+                    if value is None or not (value or keep_empty):
+                        continue
+                    if not get(target):
+                        set_value(target, value)
 
-    terminal_param_value = terminal_value or services.format_terminal_value(ip, port) or ""
+        if not get("center"):
+            employee["center"] = get("group_id")
+
+    terminal_param_value = terminal_value or ctx.formatted_terminal
     show_custom_terminal_input = (
         bool(terminal_param_value)
-        and terminal_param_value not in known_terminal_ips
+        and terminal_param_value not in known.ip_set
         and services.normalize_special_terminal_value(terminal_param_value) is None
     )
 
-    update_log = session.pop("update_log", None)
+    if etag and session.get("_flashes"):
+        # Los avisos generados al preparar la página no deben quedar cacheados.
+        etag = None
+    elif etag and services.get_external_employees_version() != external_version:
+        # La lista externa cambió al preparar la página: la huella debe reflejarlo.
+        etag = _build_index_etag(
+            cache_key, terminal_value, expand_details, selected, known_terminal_ips
+        )
 
-    return render_template(
-        "index.html",
-        ip=ip,
-        port=port,
-        terminal=terminal_param_value,
-        terminal_display_name=terminal_display,
-        employees=employees,
-        selected=selected,
-        employee_map=employee_map,
-        total_employees=total_employees,
-        selected_count=selected_count,
-        terminal_status=terminal_status,
-        terminal_status_errors=terminal_status_errors,
-        known_terminals=known_terminals,
-        known_terminal_ips=known_terminal_ips,
-        showing_duplicates=override_employees is not None,
-        cached_employee_count=cached_employee_count,
-        expand_details=expand_details,
-        external_employee_details=external_employee_details,
-        resolved_external_employee_details=resolved_external_employee_details,
-        employee_last_seen=employee_last_seen,
-        database_mode=is_special_selection,
-        zktime_mode=is_zktime_selection,
-        database_terminal_value=services.DATABASE_TERMINAL_KEY,
-        database_terminal_label=services.DATABASE_TERMINAL_LABEL,
-        zktime_terminal_value=services.ZKTIME_TERMINAL_KEY,
-        zktime_terminal_label=services.ZKTIME_TERMINAL_LABEL,
-        special_terminal_value=special_terminal_value,
-        special_terminal_options=services.get_special_terminal_options(),
-        show_custom_terminal_input=show_custom_terminal_input,
-        update_log=update_log,
+    response = make_response(
+        render_template(
+            _get_index_template(),
+            ip=ip,
+            port=port,
+            terminal=terminal_param_value,
+            terminal_display_name=terminal_display,
+            employees=employees,
+            selected=selected,
+            employee_map=employee_map,
+            total_employees=total_employees,
+            selected_count=selected_count,
+            terminal_status=ctx.terminal_status,
+            terminal_status_errors=ctx.terminal_status_errors,
+            known_terminals=known_terminals,
+            known_terminal_ips=known_terminal_ips,
+            showing_duplicates=override_employees is not None,
+            cached_employee_count=cached_employee_count,
+            expand_details=expand_details,
+            external_employee_details=external_employee_details,
+            resolved_external_employee_details=resolved_external_employee_details,
+            employee_last_seen=employee_last_seen,
+            database_mode=is_special_selection,
+            zktime_mode=ctx.is_zktime_selection,
+            database_terminal_value=services.DATABASE_TERMINAL_KEY,
+            database_terminal_label=services.DATABASE_TERMINAL_LABEL,
+            zktime_terminal_value=services.ZKTIME_TERMINAL_KEY,
+            zktime_terminal_label=services.ZKTIME_TERMINAL_LABEL,
+            special_terminal_value=special_terminal_value,
+            special_terminal_options=services.get_special_terminal_options(),
+            show_custom_terminal_input=show_custom_terminal_input,
+            update_log=update_log,
+            pending_card_update=pending_card_update,
+        )
     )
+    if etag:
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = "private, no-cache"
+    return response
@@ -1,31 +1,63 @@
 """Servicios y utilidades para interactuar con terminales ZKTeco."""
 from __future__ import annotations
 
+import atexit
 import csv
+import itertools
 import json
 import logging
-from collections import defaultdict
+import sys
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from datetime import datetime, timedelta, timezone
+from functools import lru_cache
 from io import BytesIO, StringIO
 from pathlib import Path
-from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+from typing import Any, Callable, Dict, FrozenSet, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Set, Tuple
 from urllib.error import URLError
 from urllib.parse import urlencode
 from urllib.request import urlopen
+from uuid import uuid4
 
 import pymysql
 from pymysql.cursors import DictCursor
-from flask import make_response, send_file
+from flask import Response, send_file, stream_with_context
 from openpyxl import Workbook, load_workbook
 
+import zk_pool
 from zk import const
 from zk_tools import DEFAULT_PORT, connect_with_retries
 from .config import get_setting
 
+try:  # orjson es opcional: si está instalado acelera la exportación JSON
+    import orjson
+except ImportError:  # pragma: no cover - depende del entorno
+    orjson = None
+try:  # ciso8601 es opcional: analiza fechas ISO 8601 en C
+    from ciso8601 import parse_datetime as _ciso_parse_datetime
+except ImportError:  # pragma: no cover - depende del entorno
+    _ciso_parse_datetime = None
+
 logger = logging.getLogger(__name__)
 
-TERMINAL_EMPLOYEES: Dict[str, List[dict]] = {}
-SELECTED_EMPLOYEES: Dict[str, Set[str]] = {}
+# Cachés LRU: se conservan como mucho MAX_CACHED_TERMINALS terminales/orígenes.
+MAX_CACHED_TERMINALS = 64
+TERMINAL_EMPLOYEES: Dict[str, List[dict]] = OrderedDict()
+# Índice UID -> posición en TERMINAL_EMPLOYEES, mantenido junto a la caché.
+TERMINAL_EMPLOYEE_INDEX: Dict[str, Dict[str, int]] = {}
+# Mapa UID -> empleado de cada caché, usado al pintar la tabla.
+TERMINAL_EMPLOYEE_MAPS: Dict[str, Dict[str, dict]] = {}
+# Versión de cada caché; el prefijo distingue procesos para que no se repitan tras reiniciar.
+TERMINAL_EMPLOYEE_VERSIONS: Dict[str, int] = {}
+_CACHE_GENERATION = uuid4().hex[:8]
+_cache_version_counter = itertools.count(1)
+SELECTED_EMPLOYEES: Dict[str, Set[str]] = OrderedDict()
+# Protege las escrituras de la caché frente a los hilos de precarga.
+_CACHE_LOCK = threading.RLock()
+
 TERMINAL_LIST_PATH = Path(__file__).resolve().parent.parent / "terminales.txt"
 
 DATABASE_TERMINAL_KEY = "__database__"
@@ -39,11 +71,17 @@ SPECIAL_TERMINALS: Dict[str, str] = {
 }
 
 
-def get_special_terminal_options() -> List[Dict[str, str]]:
+_SPECIAL_TERMINAL_OPTIONS: Tuple[Dict[str, str], ...] = tuple(
+    {"value": key, "label": label} for key, label in SPECIAL_TERMINALS.items()
+)
+
+
+def get_special_terminal_options() -> Tuple[Dict[str, str], ...]:
     """Devuelve la lista de orígenes especiales disponibles."""
-    return [{"value": key, "label": label} for key, label in SPECIAL_TERMINALS.items()]
+    return _SPECIAL_TERMINAL_OPTIONS
 
 
+@lru_cache(maxsize=1024)
 def get_special_terminal_label(value: Optional[str]) -> Optional[str]:
     """Obtiene la etiqueta asociada a un origen especial."""
     if not value:
@@ -51,6 +89,7 @@ def get_special_terminal_label(value: Optional[str]) -> Optional[str]:
     return SPECIAL_TERMINALS.get(value)
 
 
+@lru_cache(maxsize=1024)
 def normalize_special_terminal_value(value: Optional[str]) -> Optional[str]:
     """Normaliza el valor recibido y comprueba si corresponde a un origen especial."""
     if not value:
@@ -262,7 +301,7 @@ def load_zktime_employees() -> List[dict]:
 def refresh_zktime_cache() -> List[dict]:
     """Actualiza la caché interna con los empleados obtenidos desde ZK Time."""
     employees = load_zktime_employees()
-    TERMINAL_EMPLOYEES[ZKTIME_TERMINAL_KEY] = employees
+    _store_cached_employees(ZKTIME_TERMINAL_KEY, employees)
     SELECTED_EMPLOYEES.pop(ZKTIME_TERMINAL_KEY, None)
     return employees
 
@@ -363,11 +402,88 @@ def update_rrhh_cards(
     return successes, attempts, success_entries, errors
 
 
+# Actualizaciones de tarjetas en segundo plano: cada trabajo envía una tarjeta por
+# empleado al servicio externo y puede tardar bastante más que una petición web.
+CARD_UPDATE_WORKERS = 2
+MAX_CARD_UPDATE_JOBS = 32
+_CARD_UPDATE_EXECUTOR = ThreadPoolExecutor(
+    max_workers=CARD_UPDATE_WORKERS, thread_name_prefix="zk-cards"
+)
+_CARD_UPDATE_FUNCTIONS: Dict[str, Callable[[Iterable[dict]], tuple]] = {
+    "zktime": update_zktime_cards,
+    "rrhh": update_rrhh_cards,
+}
+CARD_UPDATE_JOBS: "OrderedDict[str, Tuple[str, Future]]" = OrderedDict()
+
+
+def submit_card_update(kind: str, employees: Iterable[dict]) -> str:
+    """Lanza la actualización de tarjetas ``kind`` en segundo plano y devuelve su id."""
+    update = _CARD_UPDATE_FUNCTIONS[kind]
+    job_id = uuid4().hex
+    future = _CARD_UPDATE_EXECUTOR.submit(update, list(employees))
+    with _CACHE_LOCK:
+        CARD_UPDATE_JOBS[job_id] = (kind, future)
+        # Solo se descartan trabajos terminados: los que siguen en marcha deben
+        # poder consultarse aunque se supere el límite.
+        excess = len(CARD_UPDATE_JOBS) - MAX_CARD_UPDATE_JOBS
+        if excess > 0:
+            finished = [key for key, (_, job) in CARD_UPDATE_JOBS.items() if job.done()]
+            for key in finished[:excess]:
+                del CARD_UPDATE_JOBS[key]
+    return job_id
+
+
+def get_card_update_job(job_id: str) -> Optional[Tuple[str, Future]]:
+    """Devuelve el tipo y el ``Future`` de una actualización de tarjetas."""
+    return CARD_UPDATE_JOBS.get(job_id)
+
+
+def forget_card_update_job(job_id: str) -> None:
+    """Descarta una actualización de tarjetas cuyo resultado ya se mostró."""
+    with _CACHE_LOCK:
+        CARD_UPDATE_JOBS.pop(job_id, None)
+
+
 EXTERNAL_EMPLOYEE_URL = get_setting(
     "EXTERNAL_EMPLOYEE_URL", "http://lpa6.bonny.eu:8888/rh/zk.employees"
 )
 EXTERNAL_EMPLOYEE_CACHE_TTL = timedelta(hours=2)
-EXTERNAL_EMPLOYEE_CACHE: Dict[str, object] = {"data": None, "timestamp": None}
+# "version" solo cambia cuando una descarga trae datos distintos de los guardados.
+# "attempt" cuenta las descargas intentadas y "failed_at"/"error" recuerdan la
+# última fallida, para no repetirla mientras dure EXTERNAL_FAILURE_TTL.
+EXTERNAL_EMPLOYEE_CACHE: Dict[str, object] = {
+    "data": None,
+    "timestamp": None,
+    "version": 0,
+    "attempt": 0,
+    "failed_at": None,
+    "error": None,
+}
+EXTERNAL_FAILURE_TTL = timedelta(seconds=30)
+_external_version_counter = itertools.count(1)
+_EXTERNAL_DOWNLOAD_LOCK = threading.Lock()
+# Mapeos derivados de la lista externa, junto a la lista de la que se construyeron.
+EXTERNAL_EMPLOYEE_MAPS: Dict[str, Tuple[Optional[List[dict]], Dict[str, dict]]] = {}
+
+# Conexiones simultáneas con un mismo terminal al eliminar empleados.
+DELETE_MAX_WORKERS = 4
+# Tiempo máximo que una petición espera a un trabajo enviado al pool de terminales.
+TERMINAL_JOB_TIMEOUT = 60
+# Hilos para descargar plantillas por una segunda conexión mientras se leen los usuarios.
+_TEMPLATE_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="zk-templates")
+
+TERMINAL_FETCH_CACHE_TTL = timedelta(seconds=30)
+# Antigüedad máxima de las plantillas reutilizadas en refrescos incrementales.
+TERMINAL_FULL_READ_INTERVAL = timedelta(minutes=10)
+# Conserva la última lectura aunque caduque: sirve para refrescos incrementales.
+# Cada entrada guarda (leída en, última lectura completa, empleados).
+TERMINAL_FETCH_CACHE: Dict[Tuple[str, int], Tuple[datetime, datetime, List[dict]]] = OrderedDict()
+# Precarga en segundo plano de los terminales consultados recientemente.
+WARM_REFRESH_INTERVAL = 60.0  # segundos entre relecturas
+WARM_IDLE_TIMEOUT = 600.0  # se deja de precargar tras 10 minutos sin consultas
+WARM_LAST_ACCESS: Dict[str, float] = {}
+_WARM_THREADS: Dict[Tuple[str, int], threading.Thread] = {}
+_WARM_STOP = threading.Event()
 
 EXPORT_COLUMNS: Sequence[Tuple[str, str]] = (
     ("uid", "UID"),
@@ -382,6 +498,9 @@ EXPORT_COLUMNS: Sequence[Tuple[str, str]] = (
     ("biometrics", "Biometría"),
 )
 
+_EXPORT_TIMESTAMP_FORMAT = "%Y%m%d-%H%M%S"
+_COLON_TO_DASH = str.maketrans({":": "-"})
+
 SPANISH_MONTH_ABBR = {
     1: "Ene",
     2: "Feb",
@@ -398,33 +517,82 @@ SPANISH_MONTH_ABBR = {
 }
 
 
-def fetch_employees(host: str, port: int = DEFAULT_PORT) -> List[dict]:
-    """Obtiene los empleados del terminal incluyendo datos biométricos."""
-    zk = conn = None
+def _load_template_index(conn) -> Dict[int, List[TmplInfo]]:
+    """Descarga las plantillas biométricas del terminal agrupadas por UID."""
     try:
-        zk, conn = connect_with_retries(host, port)
-        users = conn.get_users()
+        templates = conn.get_templates()
+    except Exception as exc:  # pragma: no cover - depende del terminal
+        logger.warning("No fue posible obtener plantillas biométricas: %s", exc)
+        templates = []
+
+    template_index: Dict[int, List[TmplInfo]] = {}
+    for template in templates or []:
+        uid = getattr(template, "uid", None)
+        if uid is None:
+            continue
         try:
-            templates = conn.get_templates()
-        except Exception as exc:  # pragma: no cover - depende del terminal
-            logger.warning("No fue posible obtener plantillas biométricas: %s", exc)
-            templates = []
-
-        template_index: Dict[int, List[dict]] = {}
-        for template in templates or []:
-            uid = getattr(template, "uid", None)
-            if uid is None:
-                continue
-            template_index.setdefault(uid, []).append(
-                {
-                    "fid": getattr(template, "fid", ""),
-                    "type": getattr(template, "type", ""),
-                    "valid": getattr(template, "valid", ""),
-                    "size": len(getattr(template, "template", b""))
-                    if hasattr(template, "template")
-                    else None,
-                }
+            raw = template.template
+        except AttributeError:  # SDK no estándar sin los datos de la plantilla
+            raw = None
+        template_index.setdefault(uid, []).append(
+            TmplInfo(
+                getattr(template, "fid", ""),
+                getattr(template, "type", ""),
+                getattr(template, "valid", ""),
+                len(raw) if raw is not None else None,
             )
+        )
+    return template_index
+
+
+def _load_template_index_pooled(host: str, port: int) -> Dict[int, List[TmplInfo]]:
+    # La segunda conexión es opcional: si el terminal no la acepta enseguida se
+    # leen las plantillas en serie, así que no se reintenta.
+    with zk_pool.reserve(host, port, fail_fast=True) as conn:
+        return _load_template_index(conn)
+
+
+def fetch_employees(
+    host: str, port: int = DEFAULT_PORT, previous: Optional[List[dict]] = None
+) -> List[dict]:
+    """Obtiene los empleados del terminal incluyendo datos biométricos.
+
+    Si ``previous`` es una lectura anterior del mismo terminal y el conjunto de
+    UID no ha cambiado, se reutilizan sus datos biométricos en lugar de volver a
+    descargar todas las plantillas. En una lectura completa las plantillas se
+    descargan por una segunda conexión en paralelo a los usuarios; esa conexión
+    se intenta una sola vez con un tiempo máximo corto y, si el terminal no la
+    admite, las plantillas se leen en serie por la misma conexión.
+    """
+    templates_future = None
+    if not previous:
+        templates_future = _TEMPLATE_EXECUTOR.submit(_load_template_index_pooled, host, port)
+
+    with zk_pool.reserve(host, port) as conn:
+        users = conn.get_users()
+
+        biometrics_for = None
+        if previous:
+            previous_biometrics = {emp.get("uid"): emp.get("biometrics", []) for emp in previous}
+            if previous_biometrics.keys() == {str(getattr(user, "uid", "")) for user in users}:
+                biometrics_for = lambda uid, default: previous_biometrics.get(str(uid), default)
+        if biometrics_for is None:
+            template_index = None
+            # Si la descarga paralela aún no ha empezado se cancela; si ya está en
+            # marcha, solo se espera un tiempo máximo antes de leer en serie.
+            if templates_future is not None and not templates_future.cancel():
+                try:
+                    template_index = templates_future.result(timeout=TERMINAL_JOB_TIMEOUT)
+                except Exception as exc:  # pragma: no cover - depende del terminal
+                    logger.warning(
+                        "No fue posible abrir una segunda conexión con %s; "
+                        "se leen las plantillas en serie: %s",
+                        host,
+                        exc,
+                    )
+            if template_index is None:
+                template_index = _load_template_index(conn)
+            biometrics_for = template_index.get
 
         employees: List[dict] = []
         for user in users:
@@ -437,72 +605,239 @@ def fetch_employees(host: str, port: int = DEFAULT_PORT) -> List[dict]:
                     "card": getattr(user, "card", ""),
                     "privilege": getattr(user, "privilege", ""),
                     "group_id": getattr(user, "group_id", ""),
-                    "biometrics": template_index.get(uid, []),
+                    "biometrics": biometrics_for(uid, []),
                 }
             )
         return employees
-    finally:
-        try:
-            if conn:
-                conn.disconnect()
-        except Exception:  # pragma: no cover - errores de red
-            logger.exception("Error al desconectar del terminal %s", host)
 
 
-def delete_employees(
-    host: str, employees: Iterable[dict], port: int = DEFAULT_PORT
+def _delete_employee_batch(
+    conn, batch: Sequence[Tuple[str, Dict[str, Any]]]
 ) -> Tuple[List[str], List[Tuple[str, str]]]:
-    """Elimina empleados del terminal y devuelve listas de eliminados y errores."""
-    zk = conn = None
+    """Elimina un lote de empleados por una conexión del pool."""
     deleted: List[str] = []
     errors: List[Tuple[str, str]] = []
-    try:
-        zk, conn = connect_with_retries(host, port)
-        for employee in employees:
-            uid_str = employee.get("uid", "")
-            kwargs = {}
-            try:
-                uid_value = int(uid_str)
-            except (TypeError, ValueError):
-                uid_value = None
+    for uid_str, kwargs in batch:
+        try:
+            conn.delete_user(**kwargs)
+        except Exception as exc:  # pragma: no cover - depende del terminal
+            errors.append((uid_str, str(exc)))
+        else:
+            deleted.append(uid_str)
+    return deleted, errors
 
-            if uid_value is not None:
-                kwargs["uid"] = uid_value
 
-            user_id = (employee.get("user_id") or "").strip()
-            if user_id:
-                kwargs["user_id"] = user_id
+def fetch_employees_cached(
+    host: str, port: int = DEFAULT_PORT, force_refresh: bool = False
+) -> List[dict]:
+    """Obtiene los empleados del terminal reutilizando lecturas de los últimos segundos.
 
-            if not kwargs:
-                errors.append((str(uid_str), "El registro no tiene identificadores válidos"))
-                continue
+    Sin ``force_refresh`` (precarga en segundo plano) se reutilizan las plantillas
+    de la lectura anterior, salvo que la última lectura completa tenga más de
+    TERMINAL_FULL_READ_INTERVAL: así las huellas registradas o borradas en el
+    terminal acaban apareciendo aunque no cambien los usuarios.
+    """
+    key = (host, port)
+    now = datetime.now(timezone.utc)
+    cached = TERMINAL_FETCH_CACHE.get(key)
+    if not force_refresh and cached and now - cached[0] < TERMINAL_FETCH_CACHE_TTL:
+        return cached[2]
+
+    previous = None
+    full_read_at = now
+    if cached and not force_refresh and now - cached[1] < TERMINAL_FULL_READ_INTERVAL:
+        previous = cached[2]
+        full_read_at = cached[1]
+    employees = fetch_employees(host, port, previous=previous)
+    with _CACHE_LOCK:
+        TERMINAL_FETCH_CACHE[key] = (now, full_read_at, employees)
+        TERMINAL_FETCH_CACHE.move_to_end(key)
+        while len(TERMINAL_FETCH_CACHE) > MAX_CACHED_TERMINALS:
+            TERMINAL_FETCH_CACHE.popitem(last=False)
+    return employees
+
+
+def invalidate_terminal_fetch(host: str, port: int = DEFAULT_PORT) -> None:
+    """Descarta la última lectura de empleados guardada para un terminal."""
+    with _CACHE_LOCK:
+        TERMINAL_FETCH_CACHE.pop((host, port), None)
+
+
+def _forget_terminal_fetches(host: Optional[str] = None) -> None:
+    """Descarta las lecturas guardadas de un terminal (en cualquier puerto) o de todos."""
+    with _CACHE_LOCK:
+        if host is None:
+            TERMINAL_FETCH_CACHE.clear()
+            return
+        for key in [key for key in TERMINAL_FETCH_CACHE if key[0] == host]:
+            del TERMINAL_FETCH_CACHE[key]
 
+
+# Campos leídos del terminal. La vista añade a los empleados en caché datos
+# externos (centro, contrato...), que no cuentan al comparar lecturas.
+_TERMINAL_FIELDS = ("uid", "name", "user_id", "card", "privilege", "group_id", "biometrics")
+
+
+def _terminal_fields(employees: List[dict]) -> List[tuple]:
+    return [tuple(employee.get(field) for field in _TERMINAL_FIELDS) for employee in employees]
+
+
+def _warm_refresh_loop(host: str, port: int, employees: List[dict]) -> None:
+    """Relee el terminal periódicamente mientras su caché siga en uso.
+
+    Se detiene si nadie consulta el terminal en WARM_IDLE_TIMEOUT o si la caché
+    deja de contener la lectura del terminal (importación, borrado, limpieza).
+    """
+    key = (host, port)
+    try:
+        while not _WARM_STOP.wait(WARM_REFRESH_INTERVAL):
+            if time.monotonic() - WARM_LAST_ACCESS.get(host, 0.0) > WARM_IDLE_TIMEOUT:
+                break
+            if TERMINAL_EMPLOYEES.get(host) is not employees:
+                break
             try:
-                conn.delete_user(**kwargs)
+                fresh = fetch_employees_cached(host, port)
             except Exception as exc:  # pragma: no cover - depende del terminal
-                errors.append((str(uid_str), str(exc)))
-            else:
-                deleted.append(str(uid_str))
+                logger.warning("No se pudo precargar el terminal %s: %s", host, exc)
+                continue
+            with _CACHE_LOCK:
+                if TERMINAL_EMPLOYEES.get(host) is not employees:
+                    break
+                if fresh is not employees and _terminal_fields(fresh) != _terminal_fields(employees):
+                    _store_cached_employees(host, fresh)
+                    employees = fresh
     finally:
+        with _CACHE_LOCK:
+            if _WARM_THREADS.get(key) is threading.current_thread():
+                del _WARM_THREADS[key]
+
+
+def start_warm_refresh(host: str, port: int, employees: List[dict]) -> None:
+    """Mantiene caliente la caché de un terminal recién leído."""
+    key = (host, port)
+    WARM_LAST_ACCESS[host] = time.monotonic()
+    with _CACHE_LOCK:
+        thread = _WARM_THREADS.get(key)
+        if thread is not None and thread.is_alive():
+            return
+        thread = threading.Thread(
+            target=_warm_refresh_loop,
+            args=(host, port, employees),
+            name=f"zk-warm-{host}",
+            daemon=True,
+        )
+        _WARM_THREADS[key] = thread
+    thread.start()
+
+
+def stop_warm_refresh() -> None:
+    """Detiene todas las precargas en segundo plano."""
+    _WARM_STOP.set()
+
+
+atexit.register(stop_warm_refresh)
+
+
+def delete_employees(
+    host: str, employees: Iterable[dict], port: int = DEFAULT_PORT
+) -> Tuple[List[str], List[Tuple[str, str]]]:
+    """Elimina empleados del terminal y devuelve listas de eliminados y errores.
+
+    pyzk no ofrece borrado múltiple, así que los borrados se reparten entre
+    varias conexiones del pool (una por lote, ya que las sesiones no son
+    thread-safe). Los lotes cuya conexión falla, por ejemplo porque el terminal
+    no admite sesiones simultáneas, se reintentan en serie por una sola
+    conexión; cada empleado que no se pueda eliminar se devuelve como error.
+    """
+    deleted: List[str] = []
+    errors: List[Tuple[str, str]] = []
+    pending: List[Tuple[str, Dict[str, Any]]] = []
+    for employee in employees:
+        uid_str = employee.get("uid", "")
+        kwargs: Dict[str, Any] = {}
         try:
-            if conn:
-                conn.disconnect()
-        except Exception:  # pragma: no cover - errores de red
-            logger.exception("Error al desconectar del terminal %s", host)
+            uid_value = int(uid_str)
+        except (TypeError, ValueError):
+            uid_value = None
 
+        if uid_value is not None:
+            kwargs["uid"] = uid_value
+
+        user_id = (employee.get("user_id") or "").strip()
+        if user_id:
+            kwargs["user_id"] = user_id
+
+        if not kwargs:
+            errors.append((str(uid_str), "El registro no tiene identificadores válidos"))
+            continue
+        pending.append((str(uid_str), kwargs))
+
+    if not pending:
+        return deleted, errors
+
+    workers = min(DELETE_MAX_WORKERS, len(pending))
+    batches = [pending[index::workers] for index in range(workers)]
+    futures = [
+        (zk_pool.submit(host, port, _delete_employee_batch, batch), batch) for batch in batches
+    ]
+    retry: List[Tuple[str, Dict[str, Any]]] = []
+    for future, batch in futures:
+        try:
+            batch_deleted, batch_errors = future.result()
+        except Exception as exc:  # pragma: no cover - errores de red
+            logger.warning(
+                "El terminal %s rechazó una conexión simultánea; "
+                "se reintenta el lote en serie: %s",
+                host,
+                exc,
+            )
+            retry.extend(batch)
+        else:
+            deleted.extend(batch_deleted)
+            errors.extend(batch_errors)
+
+    if retry:
+        try:
+            with zk_pool.reserve(host, port) as conn:
+                batch_deleted, batch_errors = _delete_employee_batch(conn, retry)
+        except Exception as exc:  # pragma: no cover - errores de red
+            if not deleted:
+                raise
+            errors.extend((uid_str, str(exc)) for uid_str, _ in retry)
+        else:
+            deleted.extend(batch_deleted)
+            errors.extend(batch_errors)
+
+    if deleted:
+        invalidate_terminal_fetch(host, port)
     return deleted, errors
 
 
+def _run_terminal_job(host: str, port: int, job: Callable, *args):
+    """Ejecuta ``job(conn, *args)`` en el pool de conexiones esperando como mucho TERMINAL_JOB_TIMEOUT."""
+    future = zk_pool.submit(host, port, job, *args)
+    try:
+        return future.result(timeout=TERMINAL_JOB_TIMEOUT)
+    except FutureTimeoutError:
+        raise TimeoutError(
+            f"El terminal {host} no respondió en {TERMINAL_JOB_TIMEOUT} segundos."
+        ) from None
+
+
 def get_terminal_status(host: str, port: int = DEFAULT_PORT) -> Tuple[dict, List[str]]:
     """Recopila información general del terminal para mostrar al usuario."""
 
-    zk = conn = None
     info: Dict[str, Optional[str]] = {
         "Dirección IP": host,
         "Puerto": str(port),
     }
     errors: List[str] = []
+    _run_terminal_job(host, port, _collect_terminal_status, info, errors)
+    cleaned_info = {k: v for k, v in info.items() if v}
+    return cleaned_info, errors
 
+
+def _collect_terminal_status(conn, info: Dict[str, Optional[str]], errors: List[str]) -> None:
     def safe_call(attr: str, label: str) -> Optional[str]:
         if not hasattr(conn, attr):
             errors.append(f"El terminal no soporta la consulta '{label}'.")
@@ -516,65 +851,105 @@ def get_terminal_status(host: str, port: int = DEFAULT_PORT) -> Tuple[dict, List
             return None
         return str(value)
 
+    info["Número de serie"] = safe_call("get_serialnumber", "el número de serie")
+    info["Nombre del dispositivo"] = safe_call("get_device_name", "el nombre del dispositivo")
+    info["Modelo"] = safe_call("get_model", "el modelo")
+    info["Plataforma"] = safe_call("get_platform", "la plataforma")
+    info["Versión de firmware"] = safe_call("get_firmware_version", "la versión de firmware")
+    info["Dirección MAC"] = safe_call("get_mac", "la dirección MAC")
+    info["Fecha y hora"] = safe_call("get_time", "la fecha y hora")
+
+    users: List = []
     try:
-        zk, conn = connect_with_retries(host, port)
-        if conn is None:
-            raise ValueError("No se pudo establecer conexión con el terminal.")
+        users = conn.get_users() or []
+    except Exception as exc:  # pragma: no cover - dependiente del dispositivo
+        errors.append(f"No se pudo obtener la lista de usuarios: {exc}")
+    else:
+        info["Usuarios en memoria"] = str(len(users))
 
-        info["Número de serie"] = safe_call("get_serialnumber", "el número de serie")
-        info["Nombre del dispositivo"] = safe_call("get_device_name", "el nombre del dispositivo")
-        info["Modelo"] = safe_call("get_model", "el modelo")
-        info["Plataforma"] = safe_call("get_platform", "la plataforma")
-        info["Versión de firmware"] = safe_call("get_firmware_version", "la versión de firmware")
-        info["Dirección MAC"] = safe_call("get_mac", "la dirección MAC")
-        info["Fecha y hora"] = safe_call("get_time", "la fecha y hora")
+    attendance_count: Optional[int] = None
+    if hasattr(conn, "get_attendance_count"):
+        try:
+            attendance_count = conn.get_attendance_count()
+        except Exception as exc:  # pragma: no cover - dependiente del dispositivo
+            errors.append(f"No se pudo obtener el número de marcajes: {exc}")
+    elif hasattr(conn, "get_attendance"):
+        try:
+            attendances = conn.get_attendance() or []
+        except Exception as exc:  # pragma: no cover - dependiente del dispositivo
+            errors.append(f"No se pudo obtener los marcajes: {exc}")
+        else:
+            attendance_count = len(attendances)
+
+    if attendance_count is not None:
+        info["Marcajes en memoria"] = str(attendance_count)
 
-        users: List = []
+    if hasattr(conn, "get_work_code"):
         try:
-            users = conn.get_users() or []
+            workcodes = conn.get_work_code() or []
         except Exception as exc:  # pragma: no cover - dependiente del dispositivo
-            errors.append(f"No se pudo obtener la lista de usuarios: {exc}")
+            errors.append(f"No se pudo obtener los códigos de trabajo: {exc}")
         else:
-            info["Usuarios en memoria"] = str(len(users))
+            info["Códigos de trabajo"] = str(len(workcodes))
 
-        attendance_count: Optional[int] = None
-        if hasattr(conn, "get_attendance_count"):
-            try:
-                attendance_count = conn.get_attendance_count()
-            except Exception as exc:  # pragma: no cover - dependiente del dispositivo
-                errors.append(f"No se pudo obtener el número de marcajes: {exc}")
-        elif hasattr(conn, "get_attendance"):
-            try:
-                attendances = conn.get_attendance() or []
-            except Exception as exc:  # pragma: no cover - dependiente del dispositivo
-                errors.append(f"No se pudo obtener los marcajes: {exc}")
-            else:
-                attendance_count = len(attendances)
 
-        if attendance_count is not None:
-            info["Marcajes en memoria"] = str(attendance_count)
+class TmplInfo(NamedTuple):
+    """Resumen de una plantilla biométrica leída del terminal."""
 
-        if hasattr(conn, "get_work_code"):
-            try:
-                workcodes = conn.get_work_code() or []
-            except Exception as exc:  # pragma: no cover - dependiente del dispositivo
-                errors.append(f"No se pudo obtener los códigos de trabajo: {exc}")
-            else:
-                info["Códigos de trabajo"] = str(len(workcodes))
+    fid: Any
+    type: Any
+    valid: Any
+    size: Optional[int]
 
-    finally:
-        try:
-            if conn:
-                conn.disconnect()
-        except Exception:  # pragma: no cover - errores de red
-            logger.exception("Error al desconectar del terminal %s", host)
 
-    cleaned_info = {k: v for k, v in info.items() if v}
-    return cleaned_info, errors
+class KnownTerminals(NamedTuple):
+    """Terminales de `terminales.txt` con sus IP precalculadas."""
 
+    items: List[Dict[str, str]]
+    ips: Tuple[str, ...]
+    ip_set: FrozenSet[str]
 
-def load_known_terminals() -> List[Dict[str, str]]:
-    """Devuelve la lista de terminales conocidos desde el fichero `terminales.txt`."""
+
+KNOWN_TERMINALS_TTL = 5.0  # segundos entre comprobaciones de cambios en `terminales.txt`
+KNOWN_TERMINALS_CACHE: Dict[str, Any] = {
+    "path": None,
+    "mtime": None,
+    "loaded_at": 0.0,
+    "known": KnownTerminals([], (), frozenset()),
+}
+
+
+def _terminal_list_mtime() -> Optional[int]:
+    try:
+        return TERMINAL_LIST_PATH.stat().st_mtime_ns
+    except OSError:
+        return None
+
+
+def get_known_terminals() -> KnownTerminals:
+    """Devuelve los terminales conocidos, releyendo el fichero solo si cambió.
+
+    Cada KNOWN_TERMINALS_TTL segundos se comprueba la fecha de modificación de
+    `terminales.txt`, así que los cambios se aplican sin reiniciar. El resultado
+    se comparte entre peticiones y no debe modificarse.
+    """
+    now = time.monotonic()
+    same_path = KNOWN_TERMINALS_CACHE["path"] == TERMINAL_LIST_PATH
+    if same_path and now - KNOWN_TERMINALS_CACHE["loaded_at"] < KNOWN_TERMINALS_TTL:
+        return KNOWN_TERMINALS_CACHE["known"]
+    mtime = _terminal_list_mtime()
+    if same_path and mtime is not None and mtime == KNOWN_TERMINALS_CACHE["mtime"]:
+        KNOWN_TERMINALS_CACHE["loaded_at"] = now
+        return KNOWN_TERMINALS_CACHE["known"]
+    terminals = _read_known_terminals()
+    ips = tuple(item["ip"] for item in terminals)
+    known = KnownTerminals(terminals, ips, frozenset(ips))
+    KNOWN_TERMINALS_CACHE.update(path=TERMINAL_LIST_PATH, mtime=mtime, loaded_at=now, known=known)
+    return known
+
+
+def _read_known_terminals() -> List[Dict[str, str]]:
+    """Lee la lista de terminales conocidos desde el fichero `terminales.txt`."""
 
     try:
         content = TERMINAL_LIST_PATH.read_text(encoding="utf-8")
@@ -651,6 +1026,7 @@ def upload_employees(
     zk = conn = None
     uploaded: List[str] = []
     errors: List[Tuple[str, str]] = []
+    invalidate_terminal_fetch(host, port)
     try:
         zk, conn = connect_with_retries(host, port)
         if conn is None:
@@ -744,22 +1120,26 @@ def upload_employees(
     return uploaded, errors
 
 
+def _set_terminal_time(conn) -> None:
+    conn.enable_device()
+    conn.set_time(datetime.now())
+
+
 def sync_terminal_time(host: str, port: int = DEFAULT_PORT) -> None:
     """Sincroniza la fecha y hora del terminal con la del sistema."""
+    _run_terminal_job(host, port, _set_terminal_time)
 
-    zk = conn = None
-    try:
-        zk, conn = connect_with_retries(host, port)
-        if conn is None:
-            raise ValueError("No se pudo establecer conexión con el terminal.")
-        conn.enable_device()
-        conn.set_time(datetime.now())
-    finally:
-        try:
-            if conn:
-                conn.disconnect()
-        except Exception:  # pragma: no cover - errores de red
-            logger.exception("Error al desconectar del terminal %s", host)
+
+def _biometrics_as_dicts(biometrics: Iterable) -> List[dict]:
+    """Convierte los resúmenes ``TmplInfo`` en diccionarios serializables."""
+    return [bio._asdict() if isinstance(bio, TmplInfo) else bio for bio in biometrics]
+
+
+def _employee_for_json(employee: dict) -> dict:
+    biometrics = employee.get("biometrics")
+    if not biometrics:
+        return employee
+    return {**employee, "biometrics": _biometrics_as_dicts(biometrics)}
 
 
 def _stringify_export_value(value):
@@ -770,44 +1150,111 @@ def _stringify_export_value(value):
     return str(value)
 
 
+def _make_export_stringifier(key: str) -> Callable[[Any], str]:
+    """Devuelve el conversor especializado para los valores de una columna exportada."""
+    if key == "biometrics":
+
+        def stringify_json(value) -> str:
+            if value is None:
+                return ""
+            if isinstance(value, list):
+                value = _biometrics_as_dicts(value)
+            return json.dumps(value, ensure_ascii=False)
+
+        return stringify_json
+
+    def stringify_scalar(value) -> str:
+        if value.__class__ is str:
+            return value
+        return _stringify_export_value(value)
+
+    return stringify_scalar
+
+
+_EXPORT_STRINGIFIERS: Sequence[Tuple[str, Callable[[Any], str]]] = tuple(
+    (key, _make_export_stringifier(key)) for key, _ in EXPORT_COLUMNS
+)
+
+
+def _build_export_row(employee: dict) -> List[str]:
+    get = employee.get
+    return [stringify(get(key)) for key, stringify in _EXPORT_STRINGIFIERS]
+
+
+EXPORT_CHUNK_ROWS = 500  # filas por bloque al transmitir exportaciones CSV
+
+
+def _iter_csv_export(employees: List[dict]) -> Iterator[str]:
+    """Genera el CSV de exportación en bloques de ``EXPORT_CHUNK_ROWS`` filas."""
+    output = StringIO()
+    writer = csv.writer(output)
+    writer.writerow([header for _, header in EXPORT_COLUMNS])
+    for start in range(0, len(employees), EXPORT_CHUNK_ROWS):
+        writer.writerows(
+            _build_export_row(employee) for employee in employees[start : start + EXPORT_CHUNK_ROWS]
+        )
+        yield output.getvalue()
+        output.seek(0)
+        output.truncate()
+    chunk = output.getvalue()
+    if chunk:
+        yield chunk
+
+
+def _iter_json_export(employees: List[dict]) -> Iterator[bytes]:
+    """Genera el JSON de exportación empleado a empleado, con sangría de dos espacios."""
+    if not employees:
+        yield b"[]"
+        return
+    separator = b"[\n  "
+    for employee in employees:
+        row = _employee_for_json(employee)
+        if orjson is not None:
+            payload = orjson.dumps(row, option=orjson.OPT_INDENT_2)
+        else:
+            payload = json.dumps(row, ensure_ascii=False, indent=2).encode("utf-8")
+        # Los saltos de línea solo aparecen entre elementos: las cadenas JSON los escapan.
+        yield separator + payload.replace(b"\n", b"\n  ")
+        separator = b",\n  "
+    yield b"\n]"
+
+
 def build_export_response(host: str, employees: List[dict], export_format: str):
-    """Genera un archivo de exportación para los empleados seleccionados."""
-    timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
-    safe_host = host.replace(":", "-")
+    """Genera un archivo de exportación para los empleados seleccionados.
+
+    CSV y JSON se transmiten por bloques según se generan; Excel se construye
+    con el modo de solo escritura de openpyxl para no mantener el libro en memoria.
+    """
+    timestamp = datetime.now().strftime(_EXPORT_TIMESTAMP_FORMAT)
+    safe_host = host.translate(_COLON_TO_DASH)
     base_filename = f"empleados_{safe_host}_{timestamp}"
 
     if export_format == "json":
-        payload = json.dumps(employees, ensure_ascii=False, indent=2)
-        response = make_response(payload)
-        response.headers["Content-Type"] = "application/json; charset=utf-8"
+        response = Response(
+            stream_with_context(_iter_json_export(employees)),
+            content_type="application/json; charset=utf-8",
+        )
         response.headers["Content-Disposition"] = (
             f"attachment; filename={base_filename}.json"
         )
         return response
 
     if export_format == "csv":
-        output = StringIO()
-        writer = csv.writer(output)
-        writer.writerow([header for _, header in EXPORT_COLUMNS])
-        for employee in employees:
-            row = [_stringify_export_value(employee.get(key)) for key, _ in EXPORT_COLUMNS]
-            writer.writerow(row)
-        csv_data = output.getvalue()
-        response = make_response(csv_data)
-        response.headers["Content-Type"] = "text/csv; charset=utf-8"
+        response = Response(
+            stream_with_context(_iter_csv_export(employees)),
+            content_type="text/csv; charset=utf-8",
+        )
         response.headers["Content-Disposition"] = (
             f"attachment; filename={base_filename}.csv"
         )
         return response
 
     if export_format == "excel":
-        workbook = Workbook()
-        worksheet = workbook.active
-        worksheet.title = "Empleados"
+        workbook = Workbook(write_only=True)
+        worksheet = workbook.create_sheet("Empleados")
         worksheet.append([header for _, header in EXPORT_COLUMNS])
         for employee in employees:
-            row = [_stringify_export_value(employee.get(key)) for key, _ in EXPORT_COLUMNS]
-            worksheet.append(row)
+            worksheet.append(_build_export_row(employee))
         output = BytesIO()
         workbook.save(output)
         output.seek(0)
@@ -821,6 +1268,7 @@ def build_export_response(host: str, employees: List[dict], export_format: str):
     raise ValueError("Formato de exportación no soportado.")
 
 
+@lru_cache(maxsize=1024)
 def coerce_port(port_value: Optional[str]) -> int:
     try:
         port = int(port_value) if port_value is not None else DEFAULT_PORT
@@ -831,6 +1279,7 @@ def coerce_port(port_value: Optional[str]) -> int:
     return DEFAULT_PORT
 
 
+@lru_cache(maxsize=1024)
 def parse_terminal_value(value: Optional[str]) -> Tuple[Optional[str], int]:
     """Convierte el texto introducido por el usuario en IP y puerto."""
 
@@ -867,6 +1316,7 @@ def parse_terminal_value(value: Optional[str]) -> Tuple[Optional[str], int]:
     return host, port
 
 
+@lru_cache(maxsize=1024)
 def format_terminal_value(host: Optional[str], port: int) -> str:
     if not host:
         return ""
@@ -875,6 +1325,29 @@ def format_terminal_value(host: Optional[str], port: int) -> str:
     return f"{host}:{port}"
 
 
+@lru_cache(maxsize=4096)
+def _parse_iso_datetime(value: str) -> datetime:
+    """Analiza una fecha ISO 8601, con ciso8601 si está disponible.
+
+    ciso8601 solo se usa con fechas completas ``YYYY-MM-DD...``: admite fechas
+    parciales como ``2024-01`` que fromisoformat rechaza, y el resultado no debe
+    depender de que esté instalado. Lanza ``ValueError`` si el texto no es una
+    fecha ISO válida.
+    """
+    if (
+        _ciso_parse_datetime is not None
+        and len(value) >= 10
+        and value[4] == "-"
+        and value[7] == "-"
+    ):
+        try:
+            return _ciso_parse_datetime(value)
+        except ValueError:
+            pass  # formatos que solo admite fromisoformat
+    return datetime.fromisoformat(value)
+
+
+@lru_cache(maxsize=16384)
 def format_contract_date(value: Optional[str]) -> str:
     """Convierte una fecha ISO en formato ``ddMonyy`` con meses en español."""
     if not value:
@@ -888,7 +1361,7 @@ def format_contract_date(value: Optional[str]) -> str:
 
     parsed: Optional[datetime] = None
     for parser in (
-        lambda val: datetime.fromisoformat(val),
+        _parse_iso_datetime,
         lambda val: datetime.strptime(val, "%Y-%m-%d"),
         lambda val: datetime.strptime(val, "%Y/%m/%d"),
     ):
@@ -1115,7 +1588,74 @@ def _normalize_database_employee_record(raw: dict) -> Optional[dict]:
 
 def get_cached_employees(host: str) -> List[dict]:
     """Devuelve los empleados almacenados en memoria para un terminal."""
-    return TERMINAL_EMPLOYEES.get(host, [])
+    employees = TERMINAL_EMPLOYEES.get(host)
+    if employees is None:
+        return []
+    WARM_LAST_ACCESS[host] = time.monotonic()
+    try:
+        TERMINAL_EMPLOYEES.move_to_end(host)
+    except KeyError:  # desalojado por otra petición entre medias
+        pass
+    return employees
+
+
+def get_cached_employees_by_uids(host: str, uids: Iterable[str]) -> List[dict]:
+    """Devuelve los empleados en memoria con los UID indicados, en el orden de la caché."""
+    employees = TERMINAL_EMPLOYEES.get(host)
+    if not employees:
+        return []
+    position_of = TERMINAL_EMPLOYEE_INDEX.get(host, {}).get
+    positions = sorted(
+        position for position in map(position_of, uids) if position is not None
+    )
+    return [employees[position] for position in positions]
+
+
+def parse_selected_uids(values: Iterable[str], host: Optional[str]) -> FrozenSet[str]:
+    """Devuelve los UID recibidos que existen en la caché del terminal, internados."""
+    valid_uids = TERMINAL_EMPLOYEE_MAPS.get(host) if host else None
+    if not valid_uids:
+        return frozenset()
+    intern = sys.intern
+    return frozenset(intern(uid) for uid in values if uid in valid_uids)
+
+
+def get_cached_employee_map(host: str) -> Dict[str, dict]:
+    """Devuelve el mapa UID -> empleado de la caché de un terminal."""
+    return TERMINAL_EMPLOYEE_MAPS.get(host, {})
+
+
+def _store_cached_employees(host: str, employees: List[dict]) -> None:
+    """Guarda los empleados y reconstruye su índice por UID.
+
+    Los UID se internan para que las búsquedas con los UID del formulario, también
+    internados, se resuelvan por identidad.
+    """
+    index: Dict[str, int] = {}
+    employee_map: Dict[str, dict] = {}
+    for position, employee in enumerate(employees):
+        uid = employee.get("uid")
+        if uid.__class__ is str:
+            employee["uid"] = uid = sys.intern(uid)
+        index.setdefault(uid, position)
+        employee_map[uid] = employee
+    with _CACHE_LOCK:
+        TERMINAL_EMPLOYEES[host] = employees
+        TERMINAL_EMPLOYEES.move_to_end(host)
+        TERMINAL_EMPLOYEE_INDEX[host] = index
+        TERMINAL_EMPLOYEE_MAPS[host] = employee_map
+        TERMINAL_EMPLOYEE_VERSIONS[host] = next(_cache_version_counter)
+        while len(TERMINAL_EMPLOYEES) > MAX_CACHED_TERMINALS:
+            evicted, _ = TERMINAL_EMPLOYEES.popitem(last=False)
+            TERMINAL_EMPLOYEE_INDEX.pop(evicted, None)
+            TERMINAL_EMPLOYEE_MAPS.pop(evicted, None)
+            TERMINAL_EMPLOYEE_VERSIONS.pop(evicted, None)
+            SELECTED_EMPLOYEES.pop(evicted, None)
+
+
+def get_cached_employees_version(host: Optional[str]) -> str:
+    """Devuelve un identificador que cambia cada vez que se reemplaza la caché del terminal."""
+    return f"{_CACHE_GENERATION}-{TERMINAL_EMPLOYEE_VERSIONS.get(host, 0) if host else 0}"
 
 
 def refresh_database_cache() -> List[dict]:
@@ -1133,27 +1673,37 @@ def refresh_database_cache() -> List[dict]:
             continue
         normalized.append(normalized_record)
 
-    TERMINAL_EMPLOYEES[DATABASE_TERMINAL_KEY] = normalized
+    _store_cached_employees(DATABASE_TERMINAL_KEY, normalized)
     SELECTED_EMPLOYEES.pop(DATABASE_TERMINAL_KEY, None)
     return normalized
 
 
 def set_cached_employees(host: str, employees: List[dict]) -> None:
     """Guarda los empleados en memoria para un terminal."""
-    TERMINAL_EMPLOYEES[host] = employees
+    _store_cached_employees(host, employees)
 
 
 def clear_terminal_cache(host: str) -> List[dict]:
     """Elimina y devuelve los empleados en memoria de un terminal."""
-    removed = TERMINAL_EMPLOYEES.pop(host, [])
-    SELECTED_EMPLOYEES.pop(host, None)
+    with _CACHE_LOCK:
+        removed = TERMINAL_EMPLOYEES.pop(host, [])
+        TERMINAL_EMPLOYEE_INDEX.pop(host, None)
+        TERMINAL_EMPLOYEE_MAPS.pop(host, None)
+        TERMINAL_EMPLOYEE_VERSIONS.pop(host, None)
+        SELECTED_EMPLOYEES.pop(host, None)
+        _forget_terminal_fetches(host)
     return removed
 
 
 def clear_all_cache() -> None:
     """Vacía las estructuras en memoria utilizadas por la aplicación."""
-    TERMINAL_EMPLOYEES.clear()
-    SELECTED_EMPLOYEES.clear()
+    with _CACHE_LOCK:
+        TERMINAL_EMPLOYEES.clear()
+        TERMINAL_EMPLOYEE_INDEX.clear()
+        TERMINAL_EMPLOYEE_MAPS.clear()
+        TERMINAL_EMPLOYEE_VERSIONS.clear()
+        SELECTED_EMPLOYEES.clear()
+        _forget_terminal_fetches()
 
 
 def get_selected_uids(host: str) -> Set[str]:
@@ -1163,16 +1713,26 @@ def get_selected_uids(host: str) -> Set[str]:
 
 def set_selected_uids(host: str, selected: Iterable[str]) -> None:
     """Almacena los UID seleccionados para un terminal."""
-    SELECTED_EMPLOYEES[host] = set(selected)
+    selected = set(selected)
+    with _CACHE_LOCK:
+        if SELECTED_EMPLOYEES.get(host) == selected:
+            SELECTED_EMPLOYEES.move_to_end(host)
+            return
+        SELECTED_EMPLOYEES[host] = selected
+        SELECTED_EMPLOYEES.move_to_end(host)
+        while len(SELECTED_EMPLOYEES) > MAX_CACHED_TERMINALS:
+            SELECTED_EMPLOYEES.popitem(last=False)
 
 
 def remove_selected_uids(host: str, uids: Iterable[str]) -> None:
     """Elimina UID concretos del conjunto de seleccionados de un terminal."""
-    existing = SELECTED_EMPLOYEES.get(host)
-    if existing is None:
-        return
-    existing.difference_update({str(uid) for uid in uids})
-    SELECTED_EMPLOYEES[host] = existing
+    removed = {str(uid) for uid in uids}
+    with _CACHE_LOCK:
+        existing = SELECTED_EMPLOYEES.get(host)
+        if existing is None:
+            return
+        existing.difference_update(removed)
+        SELECTED_EMPLOYEES[host] = existing
 
 
 def find_duplicate_employees(employees: Iterable[dict]) -> List[dict]:
@@ -1226,33 +1786,68 @@ def _download_external_employees() -> List[dict]:
     return data
 
 
+def _external_cache_is_fresh(cached_data, cached_timestamp, now: datetime) -> bool:
+    return bool(
+        cached_data
+        and isinstance(cached_timestamp, datetime)
+        and now - cached_timestamp < EXTERNAL_EMPLOYEE_CACHE_TTL
+    )
+
+
 def load_external_employees(force_refresh: bool = False) -> List[dict]:
-    """Obtiene la lista de empleados externos, usando caché durante 2 horas."""
+    """Obtiene la lista de empleados externos, usando caché durante 2 horas.
+
+    Solo un hilo descarga la lista a la vez: el resto espera y reutiliza su
+    resultado en lugar de lanzar otra descarga idéntica. Si la descarga falla,
+    durante EXTERNAL_FAILURE_TTL no se reintenta: se devuelve la lista anterior
+    o se propaga el error, para que una caída del servicio no encadene esperas.
+    """
     cached_data = EXTERNAL_EMPLOYEE_CACHE.get("data")
     cached_timestamp = EXTERNAL_EMPLOYEE_CACHE.get("timestamp")
+    attempt = EXTERNAL_EMPLOYEE_CACHE.get("attempt")
     now = datetime.now(timezone.utc)
 
-    if (
-        not force_refresh
-        and cached_data
-        and isinstance(cached_timestamp, datetime)
-        and now - cached_timestamp < EXTERNAL_EMPLOYEE_CACHE_TTL
-    ):
+    if not force_refresh and _external_cache_is_fresh(cached_data, cached_timestamp, now):
         return cached_data
 
-    try:
-        data = _download_external_employees()
-    except Exception as exc:
-        logger.exception("Error al refrescar los empleados externos: %s", exc)
-        if cached_data:
-            return cached_data
-        raise
-
-    EXTERNAL_EMPLOYEE_CACHE["data"] = data
-    EXTERNAL_EMPLOYEE_CACHE["timestamp"] = now
+    with _EXTERNAL_DOWNLOAD_LOCK:
+        failed_at = EXTERNAL_EMPLOYEE_CACHE.get("failed_at")
+        now = datetime.now(timezone.utc)
+        retried = EXTERNAL_EMPLOYEE_CACHE.get("attempt") != attempt
+        recent_failure = failed_at is not None and now - failed_at < EXTERNAL_FAILURE_TTL
+        if retried or (recent_failure and not force_refresh):
+            # Otro hilo lo intentó mientras esperábamos, o falló hace poco.
+            cached_data = EXTERNAL_EMPLOYEE_CACHE.get("data")
+            if failed_at is None or cached_data:
+                return cached_data
+            error = EXTERNAL_EMPLOYEE_CACHE.get("error")
+            raise RuntimeError(f"No se pudo obtener la lista de empleados externos: {error}")
+        EXTERNAL_EMPLOYEE_CACHE["attempt"] = attempt + 1
+        try:
+            data = _download_external_employees()
+        except Exception as exc:
+            logger.exception("Error al refrescar los empleados externos: %s", exc)
+            EXTERNAL_EMPLOYEE_CACHE["failed_at"] = datetime.now(timezone.utc)
+            EXTERNAL_EMPLOYEE_CACHE["error"] = exc
+            if cached_data:
+                return cached_data
+            raise
+
+        now = datetime.now(timezone.utc)
+        if data != EXTERNAL_EMPLOYEE_CACHE.get("data"):
+            EXTERNAL_EMPLOYEE_CACHE["version"] = next(_external_version_counter)
+        EXTERNAL_EMPLOYEE_CACHE["data"] = data
+        EXTERNAL_EMPLOYEE_CACHE["timestamp"] = now
+        EXTERNAL_EMPLOYEE_CACHE["failed_at"] = None
+        EXTERNAL_EMPLOYEE_CACHE["error"] = None
     return data
 
 
+def get_external_employees_version() -> int:
+    """Devuelve un número que cambia cada vez que cambia el contenido de la lista externa."""
+    return EXTERNAL_EMPLOYEE_CACHE.get("version", 0)
+
+
 def _store_external_mapping_entry(
     mapping: Dict[str, dict],
     user_code: str,
@@ -1278,9 +1873,44 @@ def _store_external_mapping_entry(
             mapping[upper_trimmed] = payload
 
 
+def invalidate_external_employees() -> None:
+    """Caduca la lista externa y sus mapeos para que la próxima consulta los renueve.
+
+    Se conservan los datos anteriores como respaldo si la nueva descarga falla.
+    """
+    with _EXTERNAL_DOWNLOAD_LOCK:
+        EXTERNAL_EMPLOYEE_CACHE["timestamp"] = None
+        EXTERNAL_EMPLOYEE_MAPS.clear()
+
+
+def _get_external_map(
+    kind: str, force_refresh: bool, builder: Callable[[List[dict]], Dict[str, dict]]
+) -> Dict[str, dict]:
+    """Devuelve el mapeo ``kind`` reconstruyéndolo solo si cambió la lista externa.
+
+    La lista de ``load_external_employees`` se sustituye por otra al refrescarse,
+    así que basta con comparar su identidad para saber si el mapeo sigue vigente.
+    """
+    external_employees = load_external_employees(force_refresh=force_refresh)
+    cached = EXTERNAL_EMPLOYEE_MAPS.get(kind)
+    if cached is not None and cached[0] is external_employees:
+        return cached[1]
+    mapping = builder(external_employees)
+    EXTERNAL_EMPLOYEE_MAPS[kind] = (external_employees, mapping)
+    return mapping
+
+
 def get_external_employee_map(force_refresh: bool = False) -> Dict[str, dict]:
     """Devuelve un diccionario user_id -> datos ampliados del empleado."""
-    external_employees = load_external_employees(force_refresh=force_refresh)
+    return _get_external_map("user_id", force_refresh, _build_external_employee_map)
+
+
+def get_external_employee_map_by_dni(force_refresh: bool = False) -> Dict[str, dict]:
+    """Construye un diccionario con clave DNI para datos ampliados."""
+    return _get_external_map("dni", force_refresh, _build_external_employee_map_by_dni)
+
+
+def _build_external_employee_map(external_employees: List[dict]) -> Dict[str, dict]:
     mapping: Dict[str, dict] = {}
     for record in external_employees:
         user_code = str(record.get("CODIGO_ZK_ATRIBUTO") or "").strip()
@@ -1305,9 +1935,7 @@ def get_external_employee_map(force_refresh: bool = False) -> Dict[str, dict]:
     return mapping
 
 
-def get_external_employee_map_by_dni(force_refresh: bool = False) -> Dict[str, dict]:
-    """Construye un diccionario con clave DNI para datos ampliados."""
-    external_employees = load_external_employees(force_refresh=force_refresh)
+def _build_external_employee_map_by_dni(external_employees: List[dict]) -> Dict[str, dict]:
     mapping: Dict[str, dict] = {}
     for record in external_employees:
         dni = str(record.get("DNI") or "").strip()
@@ -1343,19 +1971,24 @@ def lookup_external_employee(identifier: str, mapping: Dict[str, dict]) -> Optio
     if not candidate:
         return None
 
-    variations = [
-        candidate,
-        candidate.upper(),
-    ]
-
+    # Los mapeos ya guardan las variantes en mayúsculas y sin ceros a la
+    # izquierda, así que se prueban en orden sin construir listas intermedias.
+    get = mapping.get
+    details = get(candidate)
+    if details is not None:
+        return details
+    upper = candidate.upper()
+    if upper != candidate:
+        details = get(upper)
+        if details is not None:
+            return details
     trimmed = candidate.lstrip("0")
-    if trimmed:
-        variations.extend([trimmed, trimmed.upper()])
-
-    for key in variations:
-        if key and key in mapping:
-            return mapping[key]
-    return None
+    if not trimmed or trimmed == candidate:
+        return None
+    details = get(trimmed)
+    if details is not None:
+        return details
+    return get(trimmed.upper())
 
 
 def format_relative_time(value: Optional[str], default: str = "N/A") -> str:
@@ -1364,7 +1997,7 @@ def format_relative_time(value: Optional[str], default: str = "N/A") -> str:
         return default
 
     try:
-        parsed = datetime.fromisoformat(value)
+        parsed = _parse_iso_datetime(value)
     except ValueError:
         try:
             parsed_date = datetime.strptime(value, "%Y-%m-%d")